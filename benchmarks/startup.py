@@ -0,0 +1,109 @@
+"""
+Measure how long a CLI made with mk_expcomb(...) takes to start, and fail if
+starting it costs more than a budget on top of starting a bare interpreter.
+
+    python benchmarks/startup.py --budget-ms 100 --out startup.json
+
+Each command is run --repeat times in a fresh interpreter, after a warm up
+run which writes bytecode to a temporary cache as an installed package would
+have. The minimum and median wall times are reported in milliseconds as JSON.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import statistics
+import subprocess
+from os.path import dirname, abspath, join as pjoin
+
+REPO_ROOT = dirname(dirname(abspath(__file__)))
+
+APP = """
+import click
+from expcomb.cmd import mk_expcomb
+from expcomb.models import Exp, ExpGroup
+
+experiments = [
+    ExpGroup([Exp(["Group", str(g)], "exp{}.{}".format(g, i), "Exp") for i in range(20)])
+    for g in range(50)
+]
+expcomb, SnakeMake = mk_expcomb(experiments, None)
+
+
+@expcomb.mk_test
+@click.argument("corpus")
+def test(corpus):
+    pass
+
+
+if __name__ == "__main__":
+    expcomb()
+"""
+
+
+def time_command(argv, repeat, env):
+    subprocess.run(argv, check=True, stdout=subprocess.DEVNULL, env=env)
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(argv, check=True, stdout=subprocess.DEVNULL, env=env)
+        times.append((time.perf_counter() - start) * 1000)
+    return {"min": min(times), "median": statistics.median(times)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--budget-ms", type=float, default=100.0)
+    parser.add_argument("--out", help="Write the results here as well as stdout.")
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        filter(None, [REPO_ROOT, env.get("PYTHONPATH")])
+    )
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        env["PYTHONPYCACHEPREFIX"] = pjoin(tmp_dir, "pycache")
+        app_path = pjoin(tmp_dir, "app.py")
+        with open(app_path, "w") as f:
+            f.write(APP)
+        commands = {
+            "python": [sys.executable, "-c", "pass"],
+            "import_click": [sys.executable, "-c", "import click"],
+            "import_expcomb_cmd": [sys.executable, "-c", "import expcomb.cmd"],
+            "cli_help": [sys.executable, app_path, "--help"],
+            "cli_test_help": [sys.executable, app_path, "test", "--help"],
+            "cli_sigtest_help": [sys.executable, app_path, "sigtest", "--help"],
+        }
+        results = {
+            name: time_command(argv, args.repeat, env)
+            for name, argv in commands.items()
+        }
+    overhead = results["cli_help"]["min"] - results["python"]["min"]
+    report = {
+        "benchmark": "startup",
+        "python": sys.version.split()[0],
+        "repeat": args.repeat,
+        "results_ms": results,
+        "cli_overhead_ms": overhead,
+        "budget_ms": args.budget_ms,
+        "within_budget": overhead <= args.budget_ms,
+    }
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(output + "\n")
+    if overhead > args.budget_ms:
+        sys.exit(
+            "CLI startup overhead of {:.1f}ms exceeds the budget of {:.1f}ms".format(
+                overhead, args.budget_ms
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
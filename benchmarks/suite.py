@@ -0,0 +1,273 @@
+"""
+Time reading, filtering and tabulating results and the significance tests on
+synthetic result trees of several sizes.
+
+    python benchmarks/suite.py --scale small --scale medium --out suite.json
+
+For each scale a result tree is written by synthetic.generate(...) to a
+temporary directory, then each benchmark is run --repeat times. The minimum
+and median wall times are reported in milliseconds as JSON, so that runs of
+different releases can be compared.
+"""
+import sys
+import json
+import time
+import argparse
+import tempfile
+import statistics
+import contextlib
+from io import StringIO
+from os.path import dirname, abspath, join as pjoin
+
+REPO_ROOT = dirname(dirname(abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+import numpy as np  # noqa: E402
+from synthetic import generate  # noqa: E402
+from expcomb.doc_utils import all_docs_from_dbs  # noqa: E402
+from expcomb.filter import SimpleFilter, empty_filter  # noqa: E402
+from expcomb.sigtest.bootstrap import (  # noqa: E402
+    Bootstrapper,
+    compare_f1s,
+    resample_many,
+)
+from expcomb.sigtest.disp import (  # noqa: E402
+    MAX_CLD_COLUMNS,
+    cld_columns,
+    cld_doc,
+    iter_sig_pairs,
+)
+from expcomb.table.cmd import add_clds, indicate_highlights  # noqa: E402
+from expcomb.table.spec import (  # noqa: E402
+    CatGroup,
+    DimGroups,
+    LookupGroupDisplay,
+    MeasuresSplit,
+    SortedColsSpec,
+    SqTableSpec,
+    SumDimGroups,
+    SumDimGroups2L,
+    SumTableSpec,
+    UnlabelledMeasure,
+)
+from expcomb.table.utils import (  # noqa: E402
+    clds_from_dbs,
+    filter_docs,
+    highlights_from_dbs,
+)
+
+# tree: arguments of generate(...); systems/iters: the all pairs comparison;
+# lines/guesses/resamples: bootstrap resampling.
+SCALES = {
+    "small": {
+        "tree": {"exps": 20, "corpora": 3, "reruns": 2, "dbs": 12},
+        "systems": 20,
+        "iters": 1000,
+        "lines": 2000,
+        "guesses": 4,
+        "resamples": 50,
+    },
+    "medium": {
+        "tree": {"exps": 100, "corpora": 5, "reruns": 3, "dbs": 50},
+        "systems": 100,
+        "iters": 1000,
+        "lines": 10000,
+        "guesses": 8,
+        "resamples": 100,
+    },
+    "large": {
+        "tree": {"exps": 300, "corpora": 6, "reruns": 3, "dbs": 200},
+        "systems": 300,
+        "iters": 1000,
+        "lines": 20000,
+        "guesses": 10,
+        "resamples": 100,
+    },
+}
+
+FILTERS = [
+    SimpleFilter("System", "sys0"),
+    SimpleFilter(variant="v1"),
+    SimpleFilter("System", "sys1", variant="v2"),
+    SimpleFilter(nick="exp3"),
+    SimpleFilter("Nonexistent"),
+]
+
+
+def pk_extra(doc):
+    return {"test-corpus": doc["test-corpus"]}
+
+
+def percent(measure):
+    return "{:.1%}".format(measure)
+
+
+def group(cat):
+    return LookupGroupDisplay(CatGroup(cat))
+
+
+TABLES = {
+    "sq_table": SqTableSpec(
+        DimGroups([group("nick")]),
+        DimGroups([group("test-corpus")]),
+        UnlabelledMeasure("F1"),
+    ),
+    "sum_table": SumTableSpec(
+        SumDimGroups(),
+        DimGroups([group("test-corpus")]),
+        MeasuresSplit(["P", "R", "F1"]),
+    ),
+    "sum_table_2l": SumTableSpec(
+        SumDimGroups2L(),
+        DimGroups([group("test-corpus")]),
+        MeasuresSplit(["P", "R", "F1"]),
+    ),
+    "sorted_cols_table": SortedColsSpec(
+        DimGroups([group("test-corpus")], flat_headings=True),
+        DimGroups([group("nick")]),
+        UnlabelledMeasure("F1"),
+        displayer=percent,
+    ),
+}
+
+
+class LineBootstrapper(Bootstrapper):
+    """
+    Scores a guess as the proportion of its lines which are "1", so that
+    resampling rather than scoring dominates.
+    """
+
+    def score_cache(self):
+        return None
+
+    def score_one(self, gold, guess):
+        with open(guess, "rb") as f:
+            lines = f.read().split(b"\n")[:-1]
+        return lines.count(b"1") / max(len(lines), 1)
+
+
+def time_call(func, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append((time.perf_counter() - start) * 1000)
+    return {"min": min(times), "median": statistics.median(times)}
+
+
+def write_guesses(tmp_dir, rng, lines, guesses):
+    gold = pjoin(tmp_dir, "gold.txt")
+    with open(gold, "w") as f:
+        f.write("1\n" * lines)
+    paths = []
+    for idx in range(guesses):
+        path = pjoin(tmp_dir, "guess{}.txt".format(idx))
+        correct = rng.random(lines) < rng.uniform(0.5, 0.95)
+        with open(path, "w") as f:
+            f.writelines("1\n" if line else "0\n" for line in correct)
+        paths.append(path)
+    return gold, paths
+
+
+def resampled_scores(rng, systems, iters):
+    orig = np.sort(rng.uniform(0.5, 0.95, systems))
+    return orig, orig[:, np.newaxis] + rng.normal(0, 0.02, (systems, iters))
+
+
+def bench_scale(scale, tmp_dir, repeat, only):
+    params = SCALES[scale]
+    rng = np.random.default_rng(0)
+    results = {}
+
+    def bench(name, func):
+        if only and name not in only:
+            return
+        results[name] = time_call(func, repeat)
+
+    start = time.perf_counter()
+    tree = generate(pjoin(tmp_dir, "tree"), **params["tree"])
+    generate_ms = (time.perf_counter() - start) * 1000
+    db_paths = [pjoin(tmp_dir, "tree")]
+
+    bench("all_docs_from_dbs", lambda: list(all_docs_from_dbs(db_paths, pk_extra)))
+    docs = list(all_docs_from_dbs(db_paths, pk_extra))
+
+    bench("filter_docs", lambda: [filter_docs(docs, filter) for filter in FILTERS])
+
+    def annotate():
+        highlights = highlights_from_dbs(db_paths, empty_filter, "guesses")
+        maxs = highlights_from_dbs(db_paths, empty_filter, "max")
+        clds = clds_from_dbs(db_paths, empty_filter)
+        add_clds(docs, clds, pk_extra)
+        indicate_highlights(docs, highlights, pk_extra, "highlight")
+        indicate_highlights(docs, maxs, pk_extra, "max")
+
+    bench("annotate", annotate)
+    annotate()
+
+    for name, spec in TABLES.items():
+        bench(name, lambda: spec.print(docs, outf=StringIO()))
+
+    orig, resampled = resampled_scores(rng, params["systems"], params["iters"])
+    bench("compare_f1s", lambda: compare_f1s(orig, resampled))
+    pvalmat = compare_f1s(orig, resampled)
+    cld_docs = [{"nick": "exp{}".format(idx)} for idx in range(params["systems"])]
+
+    def cld():
+        columns = cld_columns(len(pvalmat), iter_sig_pairs(pvalmat), MAX_CLD_COLUMNS)
+        cld_doc(columns, orig.tolist(), cld_docs)
+
+    bench("cld", cld)
+
+    gold, guesses = write_guesses(tmp_dir, rng, params["lines"], params["guesses"])
+    bootstrapper = LineBootstrapper()
+    schedule = list(
+        bootstrapper.create_schedule_from_size(params["lines"], params["resamples"], 0)
+    )
+    bench("resample_many", lambda: resample_many(bootstrapper, gold, guesses, schedule))
+
+    summary = dict(tree)
+    del summary["db_paths"]
+    summary["result_docs_recent"] = len(docs)
+    for key in ("systems", "iters", "lines", "guesses", "resamples"):
+        summary[key] = params[key]
+    return {"params": summary, "generate_ms": generate_ms, "results_ms": results}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--scale",
+        choices=list(SCALES),
+        action="append",
+        help="Scales to run. Defaults to small and medium.",
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--only", action="append", help="Only run benchmarks with this name."
+    )
+    parser.add_argument("--out", help="Write the results here as well as stdout.")
+    args = parser.parse_args()
+
+    report = {
+        "benchmark": "suite",
+        "python": sys.version.split()[0],
+        "repeat": args.repeat,
+        "scales": {},
+    }
+    # Keep stdout for the report: progress bars and logging go to stderr
+    with contextlib.redirect_stdout(sys.stderr):
+        for scale in args.scale or ["small", "medium"]:
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                report["scales"][scale] = bench_scale(
+                    scale, tmp_dir, args.repeat, args.only
+                )
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(output + "\n")
+
+
+if __name__ == "__main__":
+    main()
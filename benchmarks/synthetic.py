@@ -0,0 +1,162 @@
+"""
+Generate a synthetic result tree resembling the output of a real expcomb
+project, for benchmarking.
+
+    python benchmarks/synthetic.py tree/ --exps 100 --corpora 5 --reruns 3
+
+Every experiment is scored on every corpus --reruns times, with each result
+doc inserted into one of --dbs .db files under results/<corpus>/. One further
+.db per corpus under sigtest/ holds the highlight-guesses and cld-label docs
+which the significance tests would have written for it.
+"""
+import os
+import json
+import random
+import argparse
+from os.path import dirname, abspath, join as pjoin
+from tinydb import TinyDB
+
+SYSTEMS_PER_PATH = 10
+VARIANTS = 5
+SYSTEMS_PER_LETTER = 5
+BASE_TIME = 1_600_000_000
+
+
+def corpus_name(idx):
+    return "corpus{}".format(idx)
+
+
+def exp_info(idx):
+    return {
+        "path": ["System", "sys{}".format(idx // SYSTEMS_PER_PATH)],
+        "nick": "exp{}".format(idx),
+        "disp": "Exp {}".format(idx),
+        "opts": {"id": idx, "variant": "v{}".format(idx % VARIANTS)},
+    }
+
+
+def result_doc(rng, exp_idx, corpus, rerun, skill):
+    prec = min(1.0, max(0.0, rng.gauss(skill, 0.02)))
+    rec = min(1.0, max(0.0, rng.gauss(skill, 0.02)))
+    doc = exp_info(exp_idx)
+    doc.update(
+        {
+            "measures": {
+                "P": prec,
+                "R": rec,
+                "F1": 2 * prec * rec / (prec + rec) if prec + rec else 0.0,
+            },
+            "guess": "guess/{}/exp{}.tsv".format(corpus, exp_idx),
+            "gold": "corpora/{}.key".format(corpus),
+            "test-corpus": corpus,
+            "time": BASE_TIME + rerun * 86400 + rng.random(),
+            "perf": {
+                "run": {
+                    "wall": rng.uniform(1, 100),
+                    "cpu": rng.uniform(1, 100),
+                    "max_rss": rng.uniform(100, 4000),
+                }
+            },
+        }
+    )
+    return doc
+
+
+def selector(doc):
+    return {
+        "path": doc["path"],
+        "gold": doc["gold"],
+        **doc["opts"],
+        "test-corpus": doc["test-corpus"],
+    }
+
+
+def sigtest_docs(latest):
+    """
+    The highlight-guesses and cld-label docs for the latest results on one
+    corpus, ranked by F1.
+    """
+    ranked = sorted(latest, key=lambda doc: -doc["measures"]["F1"])
+    selectors = [selector(doc) for doc in ranked]
+    letters = []
+    for rank in range(len(ranked)):
+        group = rank // SYSTEMS_PER_LETTER
+        letters.append([chr(ord("a") + group % 26)])
+    return [
+        {
+            "type": "highlight-guesses",
+            "guesses": selectors[: max(1, len(selectors) // 10)],
+            "max": selectors[:1],
+        },
+        {
+            "type": "cld-label",
+            "orig-scores": [doc["measures"]["F1"] for doc in ranked],
+            "docs": selectors,
+            "letters": letters,
+        },
+    ]
+
+
+def insert_all(path, docs):
+    os.makedirs(dirname(path), exist_ok=True)
+    db = TinyDB(path)
+    try:
+        db.table("results").insert_multiple(docs)
+    finally:
+        db.close()
+
+
+def generate(out_dir, exps, corpora, reruns, dbs, seed=0):
+    """
+    Write a result tree to out_dir. Returns a summary of what was written.
+    """
+    rng = random.Random(seed)
+    skills = [rng.uniform(0.5, 0.95) for _ in range(exps)]
+    dbs_per_corpus = max(1, dbs // corpora)
+    db_paths = []
+    num_docs = 0
+    for corpus_idx in range(corpora):
+        corpus = corpus_name(corpus_idx)
+        by_db = [[] for _ in range(dbs_per_corpus)]
+        latest = []
+        for exp_idx in range(exps):
+            for rerun in range(reruns):
+                doc = result_doc(rng, exp_idx, corpus, rerun, skills[exp_idx])
+                by_db[rng.randrange(dbs_per_corpus)].append(doc)
+            latest.append(doc)
+        for db_idx, docs in enumerate(by_db):
+            db_path = pjoin(out_dir, "results", corpus, "{:04d}.db".format(db_idx))
+            insert_all(db_path, docs)
+            db_paths.append(db_path)
+            num_docs += len(docs)
+        sigtest_path = pjoin(out_dir, "sigtest", corpus + ".db")
+        insert_all(sigtest_path, sigtest_docs(latest))
+        db_paths.append(sigtest_path)
+    return {
+        "exps": exps,
+        "corpora": corpora,
+        "reruns": reruns,
+        "result_dbs": dbs_per_corpus * corpora,
+        "result_docs": num_docs,
+        "db_paths": db_paths,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("out_dir")
+    parser.add_argument("--exps", type=int, default=100)
+    parser.add_argument("--corpora", type=int, default=5)
+    parser.add_argument("--reruns", type=int, default=3)
+    parser.add_argument("--dbs", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    summary = generate(
+        abspath(args.out_dir), args.exps, args.corpora, args.reruns, args.dbs, args.seed
+    )
+    del summary["db_paths"]
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == "__main__":
+    main()
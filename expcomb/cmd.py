@@ -1,16 +1,90 @@
 import click
-from expcomb.table.utils import docs_from_dbs
 from .models import BoundExpGroup
-from .utils import filter_experiments
-from .table.cmd import add_tables
-from .sigtest.cmd import merged as sigtest_merged
-from .filter import parse_filter, SimpleFilter, empty_filter
+from .registry import ExpRegistry, SnakeMakeQueries
+from .exp_manifest import dump_exp_manifest
+from expcomb import logger
+from .lazy import LazyGroup
+from .filter import parse_filter
+from .execute import execute
+from .model_cache import configure_model_cache
+from .profiling import profile_options, pop_profile_options
 import functools
+import time
+from os.path import join as pjoin
+
+
+def execute_options(func):
+    """
+    Add the options of execute(...) to a train or test command.
+    """
+    options = [
+        click.option(
+            "--jobs",
+            "-j",
+            type=int,
+            help="Run up to this many experiments at once in worker processes. "
+            "Defaults to 1, or as many as --cores and --memory allow.",
+        ),
+        click.option(
+            "--log-dir",
+            type=click.Path(file_okay=False),
+            help="Keep the captured output of each experiment here.",
+        ),
+        click.option(
+            "--cores", type=int, help="Total cores available to running experiments."
+        ),
+        click.option(
+            "--memory",
+            type=float,
+            help="Total memory in GB available to running experiments.",
+        ),
+        click.option(
+            "--runtimes",
+            type=click.Path(dir_okay=False),
+            help="JSON file of past runtimes used to start the longest first.",
+        ),
+    ]
+    for option in reversed(options):
+        func = option(func)
+    return func
+
+
+force_option = click.option(
+    "--force",
+    is_flag=True,
+    help="Rerun experiments even if their outputs are up to date.",
+)
+
+resume_option = click.option(
+    "--resume",
+    is_flag=True,
+    help="Skip experiments completed according to the journal of the last run.",
+)
+
+
+EXECUTE_OPTIONS = ("jobs", "log_dir", "cores", "memory", "runtimes")
+
+
+def pop_execute_options(kwargs):
+    return {opt: kwargs.pop(opt) for opt in EXECUTE_OPTIONS}
+
+
+def execute_profiled(profiler, tasks, **kwargs):
+    """
+    Like execute(...) but profiling each task when profiler is not None.
+    """
+    if profiler is None:
+        return execute(tasks, **kwargs)
+    try:
+        return execute(profiler.wrap_tasks(tasks), **kwargs)
+    finally:
+        profiler.report()
 
 
 def mk_expcomb(experiments, calc_score, pk_extra=None, tables=None):
+    registry = ExpRegistry(experiments)
 
-    @click.group()
+    @click.group(cls=LazyGroup)
     @click.pass_context
     @click.option("--filter")
     def expcomb(ctx, filter=None):
@@ -19,11 +93,25 @@ def mk_expcomb(experiments, calc_score, pk_extra=None, tables=None):
 
     def mk_train(inner):
 
+        @execute_options
+        @force_option
+        @resume_option
+        @profile_options
         @functools.wraps(inner)
         def wrapper(ctx, *args, **kwargs):
+            exec_opts = pop_execute_options(kwargs)
+            force = kwargs.pop("force")
+            resume = kwargs.pop("resume")
+            profiler = pop_profile_options(kwargs)
             path_info = inner(*args, **kwargs)
-            for exp_group in experiments:
-                exp_group.train_all(path_info, ctx.obj["filter"])
+            tasks = [
+                task
+                for exp_group in experiments
+                for task in exp_group.train_tasks(
+                    path_info, ctx.obj["filter"], force, resume
+                )
+            ]
+            execute_profiled(profiler, tasks, supress_exceptions=False, **exec_opts)
 
         return expcomb.command()(click.pass_context(wrapper))
 
@@ -31,22 +119,138 @@ def mk_expcomb(experiments, calc_score, pk_extra=None, tables=None):
 
     def mk_test(inner):
 
+        @execute_options
+        @force_option
+        @resume_option
+        @profile_options
+        @click.option(
+            "--cached-models",
+            type=int,
+            default=1,
+            help="Keep this many loaded models between corpora.",
+        )
+        @click.option(
+            "--cached-model-memory",
+            type=float,
+            help="Total memory in GB which cached models may take.",
+        )
         @functools.wraps(inner)
         def wrapper(ctx, *args, **kwargs):
+            exec_opts = pop_execute_options(kwargs)
+            force = kwargs.pop("force")
+            resume = kwargs.pop("resume")
+            profiler = pop_profile_options(kwargs)
+            configure_model_cache(
+                kwargs.pop("cached_models"), kwargs.pop("cached_model_memory")
+            )
+            # inner(...) can return a list of path_infos to test on several
+            # corpora
             path_info = inner(*args, **kwargs)
-            for exp_group in experiments:
-                exp_group.run_all(path_info, ctx.obj["filter"])
+            tasks = [
+                task
+                for exp_group in experiments
+                for task in exp_group.run_tasks(
+                    path_info, ctx.obj["filter"], force, resume
+                )
+            ]
+            execute_profiled(profiler, tasks, **exec_opts)
 
         return expcomb.command()(click.pass_context(wrapper))
 
     expcomb.mk_test = mk_test
 
+    def mk_worker(inner):
+        """
+        Make a command running the experiments as one of many workers sharing
+        a queue directory. Like mk_test(...), inner(...) returns the
+        path_info.
+
+        The queue directory can be reused by later runs, which skip the
+        experiments already done and retry those which have failed fewer
+        than --max-attempts times. With --force, markers written before the
+        worker started are ignored, so all workers of a forced run should be
+        started before the first experiment finishes. Otherwise, use a fresh
+        queue directory.
+        """
+
+        @force_option
+        @click.option(
+            "--queue",
+            type=click.Path(file_okay=False),
+            required=True,
+            help="Directory shared by all workers on the same corpus.",
+        )
+        @click.option("--train", is_flag=True, help="Train the experiments instead.")
+        @click.option(
+            "--heartbeat",
+            type=float,
+            default=30.0,
+            help="Seconds between touching the claim of the running experiment.",
+        )
+        @click.option(
+            "--stale-after",
+            type=float,
+            default=300.0,
+            help="Seconds after which an untouched claim is taken over.",
+        )
+        @click.option(
+            "--poll",
+            type=float,
+            default=10.0,
+            help="Seconds to wait when all remaining experiments are claimed.",
+        )
+        @click.option(
+            "--max-attempts",
+            type=int,
+            default=2,
+            help="Times to run an experiment before giving up on it.",
+        )
+        @functools.wraps(inner)
+        def wrapper(ctx, *args, **kwargs):
+            from .work_queue import WorkQueue
+
+            force = kwargs.pop("force")
+            train = kwargs.pop("train")
+            queue = WorkQueue(
+                pjoin(kwargs.pop("queue"), "train" if train else "run"),
+                kwargs.pop("heartbeat"),
+                kwargs.pop("stale_after"),
+                kwargs.pop("max_attempts"),
+                since=time.time() if force else None,
+            )
+            poll = kwargs.pop("poll")
+            path_info = inner(*args, **kwargs)
+            tasks = []
+            for exp_group in experiments:
+                if train:
+                    tasks.extend(
+                        exp_group.train_tasks(path_info, ctx.obj["filter"], force)
+                    )
+                else:
+                    tasks.extend(
+                        exp_group.run_tasks(path_info, ctx.obj["filter"], force)
+                    )
+            queue.work(tasks, poll)
+
+        return expcomb.command()(click.pass_context(wrapper))
+
+    expcomb.mk_worker = mk_worker
+
     def exp_apply_cmd(inner):
 
+        @profile_options
         @functools.wraps(inner)
         def wrapper(ctx, *args, **kwargs):
-            for exp in filter_experiments(experiments, ctx.obj["filter"]):
-                inner(exp, *args, **kwargs)
+            profiler = pop_profile_options(kwargs)
+            try:
+                for exp in registry.filter_experiments(ctx.obj["filter"]):
+                    if profiler is None:
+                        inner(exp, *args, **kwargs)
+                    else:
+                        profiler.wrap(exp.nick, inner)(exp, *args, **kwargs)
+            finally:
+                if profiler is not None:
+                    profiler.report()
 
         return expcomb.command()(click.pass_context(wrapper))
 
@@ -70,79 +274,44 @@ def mk_expcomb(experiments, calc_score, pk_extra=None, tables=None):
     expcomb.group_apply_cmd = group_apply_cmd
 
     if tables:
-        add_tables(expcomb, tables, pk_extra)
+
+        def mk_tables():
+            from .table.cmd import mk_tables_cmd
+
+            return mk_tables_cmd(tables, pk_extra)
+
+        expcomb.add_lazy_command("tables", mk_tables, "Print LaTeX tables of results.")
 
     @expcomb.command()
     @click.pass_context
     @click.argument("db_paths", type=click.Path(), nargs=-1)
     def trace(ctx, db_paths, x_groups, y_groups, header):
+        from expcomb.table.utils import docs_from_dbs
+
         docs = docs_from_dbs(db_paths, ctx.obj["filter"], pk_extra)
         for doc in docs:
             print(doc)
 
-    class SnakeMake:
-
-        @staticmethod
-        def get_nicks(filter: SimpleFilter = empty_filter):
-            for exp in filter_experiments(experiments, filter):
-                yield exp.nick
-
-        @staticmethod
-        def intersect_nicks(filter, **kwargs):
-            if all(
-                (
-                    k not in filter.opt_dict or filter.opt_dict[k] == v
-                    for k, v in kwargs.items()
+    SnakeMake = SnakeMakeQueries(registry)
+
+    @expcomb.command("export-exps")
+    @click.argument("outf", type=click.File("w"))
+    def export_exps(outf):
+        """
+        Write a JSON manifest of all experiments, which
+        expcomb.exp_manifest.load_snakemake(...) can query without importing
+        them.
+        """
+        for exp_group in experiments:
+            if exp_group.has_custom_filtering():
+                logger.warning(
+                    "%s overrides filtering, which the manifest cannot reproduce",
+                    type(exp_group).__name__,
                 )
-            ):
-                yield from SnakeMake.get_nicks(filter.intersect_opts(**kwargs))
-
-        @staticmethod
-        def get_non_group_at_once_nicks(filter: SimpleFilter = empty_filter):
-            all_nicks = set(SnakeMake.get_nicks(filter))
-            bad_nicks = SnakeMake.get_group_at_once_nicks(filter)
-            return all_nicks - bad_nicks
-
-        @staticmethod
-        def get_group_at_once_nicks(filter: SimpleFilter = empty_filter):
-            bad_nicks = set()
-            bad_groups = SnakeMake.get_group_at_once_groups(filter)
-            for exp_group in bad_groups:
-                for exp in exp_group.exps:
-                    bad_nicks.add(exp.nick)
-            return bad_nicks
-
-        @staticmethod
-        def get_group_at_once_groups(filter: SimpleFilter = empty_filter):
-            for exp_group in experiments:
-                if exp_group.group_included(filter) and exp_group.group_at_once:
-                    yield exp_group
-
-        @staticmethod
-        def get_group_at_once_map(filter: SimpleFilter = empty_filter):
-            res = {}
-            for exp_group in experiments:
-                if exp_group.group_included(filter) and exp_group.group_at_once:
-                    res[exp_group.path_nick()] = exp_group
-            return res
-
-        @staticmethod
-        def get_path_nick_map(filter: SimpleFilter = empty_filter):
-            res = {}
-            for exp_group in experiments:
-                if exp_group.group_included(filter) and exp_group.group_at_once:
-                    res[exp_group.path_nick()] = exp_group.path()
-            return res
-
-        @staticmethod
-        def get_nick_to_group_nick_map(filter: SimpleFilter = empty_filter):
-            res = {}
-            one_at_once_groups = SnakeMake.get_group_at_once_groups(filter)
-            for exp_group in one_at_once_groups:
-                if exp_group.group_included(filter) and exp_group.group_at_once:
-                    for exp in exp_group.exps:
-                        res[exp.nick] = exp_group.path_nick()
-            return res
+        try:
+            dump_exp_manifest(experiments, outf)
+        except ValueError as exc:
+            raise click.ClickException(str(exc))
 
     @expcomb.command()
     @click.pass_context
@@ -150,6 +319,10 @@ def mk_expcomb(experiments, calc_score, pk_extra=None, tables=None):
         for nick in SnakeMake.get_nicks(*ctx.obj["filter"]):
             print(nick)
 
-    expcomb.add_command(sigtest_merged, "sigtest")
+    expcomb.add_lazy_command(
+        "sigtest",
+        "expcomb.sigtest.cmd:merged",
+        "Commands for significance testing of guess",
+    )
 
     return expcomb, SnakeMake
@@ -2,6 +2,7 @@ from os.path import join as pjoin
 from glob import glob
 import os
 from tinydb import TinyDB
+from .filter import freeze
 
 
 def pk(doc, pk_extra):
@@ -13,15 +14,6 @@ def pk(doc, pk_extra):
     return freeze(pk_doc)
 
 
-def freeze(tree):
-    if isinstance(tree, dict):
-        return tuple(((k, freeze(v)) for k, v in sorted(tree.items())))
-    elif isinstance(tree, list):
-        return tuple((freeze(v) for v in tree))
-    else:
-        return tree
-
-
 def all_docs(dbs):
     for db in dbs:
         for doc in db.all():
@@ -53,13 +45,20 @@ def expand_db_paths(db_paths):
         prev_db = db
         return db.table("results")
 
+    for db_path in iter_db_paths(db_paths):
+        yield open_db(db_path)
+    close_prev()
+
+
+def iter_db_paths(db_paths):
+    """
+    Expand directories in db_paths into all .db files they contain.
+    """
     for db_path in db_paths:
         if os.path.isdir(db_path):
-            for sub_path in glob(pjoin(db_path, "**", "*.db"), recursive=True):
-                yield open_db(sub_path)
+            yield from glob(pjoin(db_path, "**", "*.db"), recursive=True)
         else:
-            yield open_db(db_path)
-    close_prev()
+            yield db_path
 
 
 def all_docs_from_dbs(db_paths, pk_extra):
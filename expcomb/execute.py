@@ -0,0 +1,383 @@
+import os
+import sys
+import json
+import time
+import pickle
+import shutil
+import tempfile
+import traceback
+from os.path import join as pjoin
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from expcomb import logger
+from .file_utils import atomic_write
+
+# Seconds for which smaller tasks may be started ahead of a pending task which
+# does not fit in the budget, after which it waits for enough to be freed
+MAX_BACKFILL_WAIT = 300.0
+
+
+@dataclass
+class Task:
+    nick: str
+    func: Callable[[], Any]
+    verb: str = "Running"
+    cores: int = 1
+    # In gigabytes
+    memory: float = 0.0
+    # Called in the parent process just before the task is run, once it has
+    # succeeded or with the Outcome once it has failed
+    on_start: Optional[Callable[[], None]] = None
+    on_success: Optional[Callable[[], None]] = None
+    on_failure: Optional[Callable[[Any], None]] = None
+
+
+@dataclass
+class Outcome:
+    nick: str
+    ok: bool
+    result: Any = None
+    error: Optional[str] = None
+    elapsed: Optional[float] = None
+
+
+class ExperimentFailure(Exception):
+    """
+    An experiment run in a worker process failed. The message contains the
+    traceback from the worker.
+    """
+
+    def __init__(self, nick, error):
+        super().__init__(f"{nick} failed:\n{error}")
+        self.nick = nick
+        self.error = error
+
+
+class RuntimeHistory:
+    """
+    The wall time of the last successful run of each experiment, stored as
+    JSON mapping nicks to seconds.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        try:
+            with open(path) as f:
+                self.runtimes = json.load(f)
+        except (OSError, ValueError):
+            self.runtimes = {}
+
+    def get(self, nick):
+        return self.runtimes.get(nick)
+
+    def record(self, outcome):
+        if outcome.ok and outcome.elapsed is not None:
+            self.runtimes[outcome.nick] = outcome.elapsed
+
+    def save(self):
+        with atomic_write(self.path) as f:
+            json.dump(self.runtimes, f, indent=1, sort_keys=True)
+
+    def longest_first(self, tasks):
+        """
+        Indices of tasks ordered by decreasing past runtime. Tasks which have
+        never run are assumed to be the longest.
+        """
+
+        def key(idx):
+            runtime = self.get(tasks[idx].nick)
+            return -runtime if runtime is not None else float("-inf")
+
+        return sorted(range(len(tasks)), key=key)
+
+
+# Tasks are inherited by forked workers rather than pickled, since they
+# usually close over unpicklable experiment functions.
+_worker_tasks: List[Task] = []
+
+
+def execute(
+    tasks,
+    jobs=None,
+    supress_exceptions=True,
+    log_dir=None,
+    cores=None,
+    memory=None,
+    runtimes=None,
+):
+    """
+    Run tasks serially in this process, or with up to jobs forked worker
+    processes at once. Workers are packed so that the cores and memory (in
+    gigabytes) required by running tasks stay within the given budgets, if
+    any. jobs defaults to 1, or to as many as the budget allows when one is
+    given. When runtimes is the path of a RuntimeHistory, the tasks which took
+    longest last time are started first and the history is updated.
+
+    Each worker captures the output of its task into a log, which is written
+    to log_dir as <nick>.log when it is given and echoed to stderr once the
+    task is done. When running serially, output is only captured like this
+    when log_dir is given. Exceptions are printed and the task is counted as failed
+    when supress_exceptions is true, otherwise they are reraised. Returns an
+    Outcome per task in the same order as tasks.
+    """
+    tasks = list(tasks)
+    if jobs is None:
+        jobs = default_jobs(cores, memory)
+    history = RuntimeHistory(runtimes) if runtimes is not None else None
+    try:
+        if jobs > 1 and len(tasks) > 1:
+            outcomes = execute_pool(
+                tasks, jobs, supress_exceptions, log_dir, cores, memory, history
+            )
+        else:
+            outcomes = []
+            for task in tasks:
+                outcome = execute_serial(task, supress_exceptions, log_dir)
+                finish(task, outcome, history)
+                outcomes.append(outcome)
+    finally:
+        if history is not None:
+            history.save()
+    log_summary(outcomes)
+    return outcomes
+
+
+def default_jobs(cores, memory):
+    if cores is not None:
+        return max(cores, 1)
+    if memory is not None:
+        return os.cpu_count() or 1
+    return 1
+
+
+def execute_serial(task, supress_exceptions, log_dir=None):
+    if log_dir is None:
+        return run_serial_task(task, supress_exceptions)
+    os.makedirs(log_dir, exist_ok=True)
+    path = log_path(log_dir, task.nick)
+    try:
+        with capture_output(path):
+            return run_serial_task(task, supress_exceptions)
+    finally:
+        echo_log(path)
+
+
+def run_serial_task(task, supress_exceptions):
+    start_task(task)
+    logger.info("%s %s", task.verb, task.nick)
+    start = time.monotonic()
+    try:
+        result = task.func()
+    except Exception:
+        outcome = Outcome(task.nick, False, error=traceback.format_exc())
+        if supress_exceptions:
+            traceback.print_exc()
+            return outcome
+        else:
+            if task.on_failure is not None:
+                task.on_failure(outcome)
+            raise
+    logger.info("Got %s", result)
+    return Outcome(task.nick, True, result, elapsed=time.monotonic() - start)
+
+
+def start_task(task):
+    if task.on_start is not None:
+        task.on_start()
+
+
+def finish(task, outcome, history):
+    if history is not None:
+        history.record(outcome)
+    if outcome.ok:
+        if task.on_success is not None:
+            task.on_success()
+    elif task.on_failure is not None:
+        task.on_failure(outcome)
+
+
+class Budget:
+
+    def __init__(self, cores, memory):
+        self.cores = cores
+        self.memory = memory
+
+    def fits(self, task):
+        return (self.cores is None or task.cores <= self.cores) and (
+            self.memory is None or task.memory <= self.memory
+        )
+
+    def take(self, task):
+        self.adjust(-task.cores, -task.memory)
+
+    def give(self, task):
+        self.adjust(task.cores, task.memory)
+
+    def adjust(self, cores, memory):
+        if self.cores is not None:
+            self.cores += cores
+        if self.memory is not None:
+            self.memory += memory
+
+
+def execute_pool(tasks, jobs, supress_exceptions, log_dir, cores, memory, history):
+    # Imported here since it is only needed with --jobs and slows down startup
+    import multiprocessing
+    from multiprocessing.connection import wait
+
+    global _worker_tasks
+    tmp_log_dir = None
+    if log_dir is None:
+        tmp_log_dir = log_dir = tempfile.mkdtemp(prefix="expcomb-logs-")
+    else:
+        os.makedirs(log_dir, exist_ok=True)
+    _worker_tasks = tasks
+    outcomes: List[Optional[Outcome]] = [None] * len(tasks)
+    if history is not None:
+        pending = history.longest_first(tasks)
+    else:
+        pending = list(range(len(tasks)))
+    budget = Budget(cores, memory)
+    running: Dict[Any, Tuple[int, Any, float]] = {}
+    ctx = multiprocessing.get_context("fork")
+    # The first pending task which did not fit and since when
+    blocked: Optional[Tuple[int, float]] = None
+    try:
+        while pending or running:
+            # Start every pending task which fits, in order, so smaller tasks
+            # can fill in around bigger ones until the first which does not
+            # fit has waited MAX_BACKFILL_WAIT. A task which can never fit is
+            # run on its own.
+            head_blocked = False
+            for idx in list(pending):
+                if len(running) >= jobs:
+                    break
+                task = tasks[idx]
+                if not budget.fits(task):
+                    if running:
+                        if not head_blocked:
+                            head_blocked = True
+                            if blocked is None or blocked[0] != idx:
+                                blocked = (idx, time.monotonic())
+                            elif time.monotonic() - blocked[1] >= MAX_BACKFILL_WAIT:
+                                break
+                        continue
+                    logger.warning("%s exceeds the resource budget", task.nick)
+                if not head_blocked:
+                    blocked = None
+                pending.remove(idx)
+                budget.take(task)
+                start_task(task)
+                conn, child_conn = ctx.Pipe(duplex=False)
+                proc = ctx.Process(
+                    target=worker_main,
+                    args=(idx, log_path(log_dir, task.nick), child_conn),
+                )
+                proc.start()
+                child_conn.close()
+                running[conn] = (idx, proc, time.monotonic())
+            for conn in wait(list(running)):
+                idx, proc, start = running.pop(conn)
+                task = tasks[idx]
+                try:
+                    outcome = conn.recv()
+                except EOFError:
+                    outcome = Outcome(task.nick, False)
+                conn.close()
+                proc.join()
+                budget.give(task)
+                if outcome.error is None and not outcome.ok:
+                    outcome.error = f"Worker exited with code {proc.exitcode}"
+                outcome.elapsed = time.monotonic() - start
+                echo_log(log_path(log_dir, task.nick))
+                outcomes[idx] = outcome
+                finish(task, outcome, history)
+                if outcome.ok:
+                    logger.info("Got %s", outcome.result)
+                elif not supress_exceptions:
+                    raise ExperimentFailure(outcome.nick, outcome.error)
+                else:
+                    logger.error("%s failed: %s", outcome.nick, outcome.error)
+    finally:
+        for conn, (idx, proc, start) in running.items():
+            proc.terminate()
+            proc.join()
+            conn.close()
+        _worker_tasks = []
+        if tmp_log_dir is not None:
+            shutil.rmtree(tmp_log_dir, ignore_errors=True)
+    return outcomes
+
+
+def log_path(log_dir, nick):
+    return pjoin(log_dir, nick + ".log")
+
+
+def worker_main(idx, path, conn):
+    conn.send(run_worker_task(idx, path))
+    conn.close()
+
+
+def run_worker_task(idx, path):
+    """
+    Run a task in a worker process with stdout and stderr redirected to a log
+    file.
+    """
+    task = _worker_tasks[idx]
+    with capture_output(path):
+        logger.info("%s %s", task.verb, task.nick)
+        try:
+            result = task.func()
+            try:
+                pickle.dumps(result)
+            except Exception:
+                result = repr(result)
+            outcome = Outcome(task.nick, True, result)
+        except Exception:
+            traceback.print_exc()
+            outcome = Outcome(task.nick, False, error=traceback.format_exc())
+    return outcome
+
+
+@contextmanager
+def capture_output(path):
+    """
+    Redirect stdout and stderr, including those of subprocesses, to the file
+    at path, restoring them afterwards.
+    """
+    sys.stdout.flush()
+    sys.stderr.flush()
+    saved = [os.dup(1), os.dup(2)]
+    try:
+        with open(path, "w") as log_f:
+            os.dup2(log_f.fileno(), 1)
+            os.dup2(log_f.fileno(), 2)
+            try:
+                yield
+            finally:
+                sys.stdout.flush()
+                sys.stderr.flush()
+    finally:
+        os.dup2(saved[0], 1)
+        os.dup2(saved[1], 2)
+        for fd in saved:
+            os.close(fd)
+
+
+def echo_log(path):
+    try:
+        with open(path) as log_f:
+            log = log_f.read()
+    except OSError:
+        return
+    sys.stderr.write(log)
+    sys.stderr.flush()
+
+
+def log_summary(outcomes):
+    succeeded = [outcome.nick for outcome in outcomes if outcome.ok]
+    failed = [outcome.nick for outcome in outcomes if not outcome.ok]
+    logger.info("%s succeeded: %s", len(succeeded), ", ".join(succeeded))
+    if failed:
+        logger.info("%s failed: %s", len(failed), ", ".join(failed))
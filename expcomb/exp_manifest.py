@@ -0,0 +1,149 @@
+"""
+A JSON description of all experiments which Snakefiles can query without
+importing the experiment module:
+
+    from expcomb.exp_manifest import load_snakemake
+    SnakeMake = load_snakemake("exps.json")
+"""
+import json
+from expcomb.registry import ExpRegistry, SnakeMakeQueries
+
+EXP_MANIFEST_VERSION = 1
+# Tuples are stored as {TUPLE_KEY: [...]} so they are not loaded as lists
+TUPLE_KEY = "__tuple__"
+
+
+def group_path(exp_group):
+    paths = {tuple(exp.path) for exp in exp_group.exps}
+    if len(paths) != 1:
+        return None
+    return list(paths.pop())
+
+
+def encode_value(value, where):
+    """
+    Encode an opt or group attribute value for JSON, keeping tuples apart
+    from lists. Raises a ValueError naming where for values which JSON can't
+    represent, such as enums and paths.
+    """
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    if isinstance(value, tuple):
+        return {TUPLE_KEY: [encode_value(v, where) for v in value]}
+    if isinstance(value, list):
+        return [encode_value(v, where) for v in value]
+    if isinstance(value, dict) and all(isinstance(k, str) for k in value):
+        return {k: encode_value(v, where) for k, v in value.items()}
+    raise ValueError(
+        "{} = {!r} can't be written to an experiment manifest".format(where, value)
+    )
+
+
+def decode_value(value):
+    if isinstance(value, list):
+        return [decode_value(v) for v in value]
+    if isinstance(value, dict):
+        if list(value) == [TUPLE_KEY]:
+            return tuple(decode_value(v) for v in value[TUPLE_KEY])
+        return {k: decode_value(v) for k, v in value.items()}
+    return value
+
+
+def exp_manifest(experiments):
+    groups = []
+    for exp_group in experiments:
+        path = group_path(exp_group)
+        groups.append(
+            {
+                "group_at_once": exp_group.group_at_once,
+                "group_attrs": {
+                    attr: encode_value(
+                        getattr(exp_group, attr), "group attribute " + attr
+                    )
+                    for attr in exp_group.group_attrs
+                },
+                "path": path,
+                "path_nick": exp_group.path_nick() if path is not None else None,
+                "custom_filtering": exp_group.has_custom_filtering(),
+                "exps": [
+                    {
+                        "nick": exp.nick,
+                        "path": exp.path,
+                        "opts": {
+                            opt: encode_value(value, "{} opt {}".format(exp.nick, opt))
+                            for opt, value in exp.opts.items()
+                        },
+                    }
+                    for exp in exp_group.exps
+                ],
+            }
+        )
+    return {"version": EXP_MANIFEST_VERSION, "groups": groups}
+
+
+def dump_exp_manifest(experiments, outf):
+    json.dump(exp_manifest(experiments), outf, separators=(",", ":"))
+
+
+class ManifestExp:
+
+    def __init__(self, nick, path, opts):
+        self.nick = nick
+        self.path = path
+        self.opts = opts
+
+
+class ManifestGroup:
+    """
+    Stands in for an ExpGroup loaded from an experiment manifest.
+    """
+
+    def __init__(self, group_doc):
+        self.group_at_once = group_doc["group_at_once"]
+        self.group_attr_values = decode_value(group_doc["group_attrs"])
+        self.group_attrs = tuple(self.group_attr_values)
+        self._path = group_doc["path"]
+        self._path_nick = group_doc["path_nick"]
+        self.exps = [
+            ManifestExp(exp_doc["nick"], exp_doc["path"], decode_value(exp_doc["opts"]))
+            for exp_doc in group_doc["exps"]
+        ]
+
+    def process_group_opts(self, opt_dict):
+        opt_dict = opt_dict.copy()
+        included = True
+        for group_attr in self.group_attrs:
+            if group_attr in opt_dict:
+                if opt_dict[group_attr] != self.group_attr_values[group_attr]:
+                    included = False
+                del opt_dict[group_attr]
+        return included, opt_dict
+
+    def has_custom_filtering(self):
+        return False
+
+    def path(self):
+        assert self._path is not None
+        return self._path
+
+    def path_nick(self):
+        assert self._path_nick is not None
+        return self._path_nick
+
+
+def load_snakemake(path):
+    """
+    Queries like the SnakeMake of mk_expcomb(...) over a manifest written by
+    export-exps. Groups which override filter_exps(...), exp_included(...) or
+    group_included(...) are filtered as if they did not.
+    """
+    with open(path) as f:
+        manifest = json.load(f)
+    if manifest.get("version") != EXP_MANIFEST_VERSION:
+        raise ValueError(
+            "{} has unsupported experiment manifest version {}".format(
+                path, manifest.get("version")
+            )
+        )
+    groups = [ManifestGroup(group_doc) for group_doc in manifest["groups"]]
+    return SnakeMakeQueries(ExpRegistry(groups))
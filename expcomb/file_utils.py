@@ -0,0 +1,33 @@
+import os
+import tempfile
+from contextlib import contextmanager
+from os.path import dirname
+
+
+def current_umask():
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+
+@contextmanager
+def atomic_write(path, mode="w"):
+    """
+    Write to a temporary file which replaces path once the block exits
+    without an exception, so that readers never see a partial file.
+    """
+    directory = dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, mode) as f:
+            # mkstemp(...) makes files only readable by their owner
+            os.fchmod(fd, 0o666 & ~current_umask())
+            yield f
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
@@ -1,5 +1,13 @@
 from typing import Optional
-from .doc_utils import freeze
+
+
+def freeze(tree):
+    if isinstance(tree, dict):
+        return tuple(((k, freeze(v)) for k, v in sorted(tree.items())))
+    elif isinstance(tree, list):
+        return tuple((freeze(v) for v in tree))
+    else:
+        return tree
 
 
 class SimpleFilter:
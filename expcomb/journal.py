@@ -0,0 +1,60 @@
+"""
+Journals of the progress of experiments, read by --resume.
+"""
+import os
+import json
+import time
+from os.path import dirname, join as pjoin
+
+JOURNAL_NAME = ".expcomb-journal.jsonl"
+
+
+class Journal:
+    """
+    An append-only file of JSON lines, in which the last line about each
+    experiment gives its status: "pending", "completed" or "failed".
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.statuses = {}
+        try:
+            with open(path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # A line cut short by a crash
+                        continue
+                    self.statuses[(entry["kind"], entry["key"])] = entry["status"]
+        except OSError:
+            pass
+
+    def status(self, kind, key):
+        return self.statuses.get((kind, key))
+
+    def record(self, kind, key, status, error=None):
+        self.statuses[(kind, key)] = status
+        entry = {"kind": kind, "key": key, "status": status, "time": time.time()}
+        if error is not None:
+            entry["error"] = error
+        os.makedirs(dirname(self.path) or ".", exist_ok=True)
+        with open(self.path, "a") as f:
+            f.write(json.dumps(entry) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+
+class Journals:
+    """
+    The Journal of each directory containing outputs.
+    """
+
+    def __init__(self):
+        self.journals = {}
+
+    def get(self, output):
+        path = pjoin(dirname(output), JOURNAL_NAME)
+        if path not in self.journals:
+            self.journals[path] = Journal(path)
+        return self.journals[path]
@@ -0,0 +1,58 @@
+"""
+Click groups which only import their subcommands when they are used.
+"""
+import importlib
+import click
+
+
+def load_lazy(spec):
+    """
+    Load a command given either as "module:attr" or as a function returning
+    it.
+    """
+    if callable(spec):
+        return spec()
+    module_name, attr = spec.split(":")
+    return getattr(importlib.import_module(module_name), attr)
+
+
+class LazyGroup(click.Group):
+    """
+    A group with subcommands which are loaded with load_lazy(...) on first
+    use. The help of the group lists them with the short help given when
+    they were added, without loading them.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.lazy_subcommands = {}
+        self.lazy_short_help = {}
+
+    def add_lazy_command(self, name, spec, short_help=""):
+        self.lazy_subcommands[name] = spec
+        self.lazy_short_help[name] = short_help
+
+    def list_commands(self, ctx):
+        return sorted(set(super().list_commands(ctx)) | set(self.lazy_subcommands))
+
+    def get_command(self, ctx, cmd_name):
+        if cmd_name in self.lazy_subcommands:
+            self.add_command(load_lazy(self.lazy_subcommands.pop(cmd_name)), cmd_name)
+        return super().get_command(ctx, cmd_name)
+
+    def format_commands(self, ctx, formatter):
+        rows = []
+        limit = formatter.width - 6 - max(
+            (len(name) for name in self.list_commands(ctx)), default=0
+        )
+        for name in self.list_commands(ctx):
+            if name in self.lazy_subcommands:
+                rows.append((name, self.lazy_short_help[name]))
+                continue
+            cmd = self.get_command(ctx, name)
+            if cmd is None or cmd.hidden:
+                continue
+            rows.append((name, cmd.get_short_help_str(limit)))
+        if rows:
+            with formatter.section("Commands"):
+                formatter.write_dl(rows)
@@ -0,0 +1,208 @@
+"""
+Make-style up-to-date checking of experiment outputs.
+"""
+import os
+import json
+import hashlib
+from os.path import dirname, join as pjoin, relpath
+from urllib.parse import quote
+from expcomb.score_cache import file_hash
+from expcomb.journal import Journals
+from expcomb.file_utils import atomic_write
+
+MANIFEST_NAME = ".expcomb-manifest"
+
+
+def iter_files(path):
+    """
+    The files under path in a stable order, or just path if it is a file.
+    """
+    if not os.path.isdir(path):
+        yield path
+        return
+    for dirpath, dirnames, filenames in os.walk(path):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            yield pjoin(dirpath, filename)
+
+
+def path_stat(path):
+    """
+    A digest of the names, sizes and modification times of the file or all
+    files under the directory at path, or None if it does not exist.
+    """
+    if not os.path.exists(path):
+        return None
+    digest = hashlib.sha256()
+    for file_path in iter_files(path):
+        stat = os.stat(file_path)
+        bits = (relpath(file_path, path), stat.st_size, stat.st_mtime_ns)
+        digest.update(repr(bits).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def path_digest(path):
+    """
+    A digest of the names and contents of the file or all files under the
+    directory at path, or None if it does not exist.
+    """
+    if not os.path.exists(path):
+        return None
+    if not os.path.isdir(path):
+        return file_hash(path)
+    digest = hashlib.sha256()
+    for file_path in iter_files(path):
+        bits = (relpath(file_path, path), file_hash(file_path))
+        digest.update(repr(bits).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def path_unchanged(path, recorded):
+    # Like make, the contents are only hashed when the size or modification
+    # time differ
+    stat = path_stat(path)
+    if stat is None:
+        return False
+    return stat == recorded["stat"] or path_digest(path) == recorded["digest"]
+
+
+def normalise(obj):
+    """
+    Round trip obj through JSON so that it compares equal to what was stored.
+    """
+    return json.loads(json.dumps(obj, sort_keys=True, default=repr))
+
+
+class Manifest:
+    """
+    A directory of JSON files, one per experiment iden, recording what each
+    was last built from.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+
+    def entry_path(self, key):
+        return pjoin(self.path, quote(key, safe="") + ".json")
+
+    def get(self, key):
+        if key not in self.entries:
+            try:
+                with open(self.entry_path(key)) as f:
+                    self.entries[key] = json.load(f)
+            except (OSError, ValueError):
+                self.entries[key] = None
+        return self.entries[key]
+
+    def is_current(self, key, info, inputs, outputs):
+        entry = self.get(key)
+        if entry is None or entry["info"] != normalise(info):
+            return False
+        for kind, paths in (("inputs", inputs), ("outputs", outputs)):
+            recorded = entry[kind]
+            if set(recorded) != set(paths):
+                return False
+            for path in paths:
+                if not path_unchanged(path, recorded[path]):
+                    return False
+        return True
+
+    def record(self, key, info, inputs, outputs):
+        entry = {"info": normalise(info)}
+        for kind, paths in (("inputs", inputs), ("outputs", outputs)):
+            entry[kind] = {
+                path: {"stat": path_stat(path), "digest": path_digest(path)}
+                for path in paths
+            }
+        self.entries[key] = entry
+        self.save(key)
+
+    def invalidate(self, key):
+        self.entries[key] = None
+        try:
+            os.unlink(self.entry_path(key))
+        except FileNotFoundError:
+            pass
+
+    def save(self, key):
+        with atomic_write(self.entry_path(key)) as f:
+            json.dump(self.entries[key], f, indent=1, sort_keys=True)
+
+
+class Target:
+    """
+    The outputs of one experiment on one path_info, built from its inputs.
+    Its progress is also kept in a Journal so interrupted runs can be
+    resumed.
+    """
+
+    def __init__(self, manifest, journal, kind, key, info, inputs, outputs):
+        self.manifest = manifest
+        self.journal = journal
+        self.kind = kind
+        self.key = key
+        self.info = info
+        self.inputs = [path for path in inputs if path is not None]
+        self.outputs = [path for path in outputs if path is not None]
+
+    def is_current(self):
+        """
+        Whether the outputs are up to date, which they are not if the last
+        attempt to build them failed.
+        """
+        return (
+            bool(self.outputs)
+            and self.journal.status(self.kind, self.key) != "failed"
+            and self.manifest.is_current(self.key, self.info, self.inputs, self.outputs)
+        )
+
+    def is_completed(self):
+        return (
+            self.journal is not None
+            and self.journal.status(self.kind, self.key) == "completed"
+        )
+
+    def start(self):
+        if self.journal is not None:
+            self.journal.record(self.kind, self.key, "pending")
+
+    def record(self):
+        if self.manifest is None:
+            return
+        self.manifest.record(self.key, self.info, self.inputs, self.outputs)
+        self.journal.record(self.kind, self.key, "completed")
+
+    def fail(self, outcome):
+        if self.manifest is None:
+            return
+        self.manifest.invalidate(self.key)
+        self.journal.record(self.kind, self.key, "failed", outcome.error)
+
+
+class Manifests:
+    """
+    The Manifest and Journal of each directory containing outputs.
+    """
+
+    def __init__(self):
+        self.manifests = {}
+        self.journals = Journals()
+
+    def get(self, output):
+        path = pjoin(dirname(output), MANIFEST_NAME)
+        if path not in self.manifests:
+            self.manifests[path] = Manifest(path)
+        return self.manifests[path]
+
+    def target(self, kind, key, info, inputs, outputs):
+        """
+        Make a Target for the given kind of step, "train" or "run".
+        """
+        outputs = [path for path in outputs if path is not None]
+        if outputs:
+            manifest = self.get(outputs[0])
+            journal = self.journals.get(outputs[0])
+        else:
+            manifest = journal = None
+        return Target(manifest, journal, kind, key, info, inputs, outputs)
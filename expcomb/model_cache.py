@@ -0,0 +1,81 @@
+"""
+An in-process LRU cache of loaded models.
+"""
+import os
+from collections import OrderedDict
+from expcomb import logger
+from expcomb.manifest import iter_files, path_stat
+
+_default_cache = None
+
+
+def path_size(path):
+    """
+    The total size in bytes of the file or all files under the directory at
+    path, used as an estimate of the memory taken by the loaded model.
+    """
+    return sum(os.stat(file_path).st_size for file_path in iter_files(path))
+
+
+class ModelCache:
+    """
+    Keeps up to max_models loaded models taking up to max_memory gigabytes
+    in total. The most recently used model is always kept, even if it is
+    bigger than max_memory on its own.
+    """
+
+    def __init__(self, max_models=1, max_memory=None):
+        self.max_models = max_models
+        self.max_memory = max_memory
+        self.models = OrderedDict()
+
+    def memory(self):
+        return sum(size for _, size in self.models.values())
+
+    def get(self, model_path, load, size=None):
+        """
+        Get the model at model_path, calling load() if it is not cached. size
+        is the memory taken by the model in gigabytes and defaults to the size
+        of the files at model_path. A retrained model is loaded afresh.
+        """
+        key = (model_path, path_stat(model_path))
+        if key in self.models:
+            self.models.move_to_end(key)
+            return self.models[key][0]
+        model = load()
+        if size is None:
+            size = path_size(model_path) / 2 ** 30
+        if self.max_models > 0:
+            self.models[key] = (model, size)
+            self.evict()
+        return model
+
+    def evict(self):
+        while len(self.models) > 1 and (
+            len(self.models) > self.max_models
+            or (self.max_memory is not None and self.memory() > self.max_memory)
+        ):
+            (model_path, _), _ = self.models.popitem(last=False)
+            logger.info("Evicting model %s", model_path)
+
+    def clear(self):
+        self.models.clear()
+
+
+def default_model_cache():
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = ModelCache()
+    return _default_cache
+
+
+def configure_model_cache(max_models=1, max_memory=None):
+    """
+    Set the bounds of the cache returned by default_model_cache().
+    """
+    cache = default_model_cache()
+    cache.max_models = max_models
+    cache.max_memory = max_memory
+    cache.evict()
+    if max_models <= 0:
+        cache.clear()
@@ -1,9 +1,14 @@
-import traceback
+from functools import partial
+from itertools import groupby
 from dataclasses import dataclass, field
 from typing import Any, Callable, Dict, List, Optional
 from .utils import doc_exp_included, mk_iden
 from expcomb import logger
 from .filter import SimpleFilter
+from .execute import execute, Task
+from .manifest import Manifests
+from .model_cache import default_model_cache
+from .perf import measure_perf, record_run_perf, update_perf
 
 
 @dataclass(frozen=True)
@@ -13,6 +18,10 @@ class Exp:
     disp: str
     run_func: Optional[Callable[[str, str, str], None]] = None
     opts: Dict[str, Any] = field(default_factory=dict)
+    # Resources needed to run/train this experiment. When None they are
+    # taken from opts and then from the ExpGroup. Memory is in gigabytes.
+    cores: Optional[int] = None
+    memory: Optional[float] = None
 
     def get_paths_from_path_info(self, path_info):
         return path_info.get_paths(mk_iden(path_info.corpus, self), self)
@@ -30,23 +39,64 @@ class Exp:
 
     def run_path_info(self, path_info, **extra):
         paths, guess_path, model_path, gold = self.get_paths_from_path_info(path_info)
-        self.run_dispatch(paths, guess_path, model_path, **extra)
+        with measure_perf() as perf:
+            self.run_dispatch(paths, guess_path, model_path, **extra)
+        record_run_perf(guess_path, model_path, perf)
         return guess_path
 
+    def run_path_infos(self, path_infos, **extra):
+        return [self.run_path_info(path_info, **extra) for path_info in path_infos]
+
+    def run_inputs(self, path_info):
+        """
+        Paths which the guess depends on. Override to add any other inputs
+        which should cause the experiment to be rerun when they change.
+        """
+        return [path_info.corpus]
+
+    def run_outputs(self, path_info):
+        _, guess_path, _, _ = self.get_paths_from_path_info(path_info)
+        return [guess_path]
+
 
 class SupExp(Exp):
+    # Subclasses can define load_model(model_path) and
+    # run_model(paths, guess_path, model) instead of run(...) so that loaded
+    # models are kept in the default ModelCache between corpora
+    load_model = None
 
     def train_model(self, path_info):
         paths, _, model_path, _ = self.get_paths_from_path_info(path_info)
-        self.train(paths, model_path)
+        with measure_perf() as perf:
+            self.train(paths, model_path)
+        update_perf(model_path, train=perf)
 
     def run_dispatch(self, paths, guess_path, model_path):
-        return self.run(paths, guess_path, model_path)
+        if self.load_model is None:
+            return self.run(paths, guess_path, model_path)
+        model = default_model_cache().get(
+            model_path, partial(self.load_model, model_path)
+        )
+        return self.run_model(paths, guess_path, model)
+
+    def run_inputs(self, path_info):
+        _, _, model_path, _ = self.get_paths_from_path_info(path_info)
+        return [path_info.corpus, model_path]
+
+    def train_inputs(self, path_info):
+        return [path_info.corpus]
+
+    def train_outputs(self, path_info):
+        _, _, model_path, _ = self.get_paths_from_path_info(path_info)
+        return [model_path]
 
 
 class ExpGroup:
     group_at_once = False
     group_attrs = ()
+    # Default resources needed by each experiment in the group
+    cores = 1
+    memory = 0.0
 
     def __init__(self, exps):
         self.exps = exps
@@ -61,49 +111,249 @@ class ExpGroup:
                 del opt_dict[group_attr]
         return included, opt_dict
 
-    def filter_exps(self, filter: SimpleFilter):
+    def group_filter(self, filter: SimpleFilter):
+        """
+        The filter to match the experiments of this group against with
+        group_attrs removed, or None if the group is excluded by them.
+        """
         included, opt_dict = self.process_group_opts(filter.opt_dict)
         if not included:
+            return None
+        return SimpleFilter(*filter.path, **opt_dict)
+
+    def exp_matches(self, exp, group_filter: SimpleFilter):
+        return doc_exp_included(group_filter, exp.path, {"nick": exp.nick, **exp.opts})
+
+    def filter_exps(self, filter: SimpleFilter):
+        if type(self).exp_included is not ExpGroup.exp_included:
+            included, _ = self.process_group_opts(filter.opt_dict)
+            if not included:
+                return []
+            return [exp for exp in self.exps if self.exp_included(exp, filter)]
+        group_filter = self.group_filter(filter)
+        if group_filter is None:
             return []
-        return [exp for exp in self.exps if self.exp_included(exp, filter)]
+        return [exp for exp in self.exps if self.exp_matches(exp, group_filter)]
 
     def exp_included(self, exp, filter: SimpleFilter):
-        included, opt_dict = self.process_group_opts(filter.opt_dict)
-        if not included:
+        group_filter = self.group_filter(filter)
+        if group_filter is None:
             return False
-        incl = doc_exp_included(
-            SimpleFilter(*filter.path, **opt_dict),
-            exp.path,
-            {"nick": exp.nick, **exp.opts},
-        )
-        return incl
+        return self.exp_matches(exp, group_filter)
 
     def group_included(self, filter: SimpleFilter):
-        included, opt_dict = self.process_group_opts(filter.opt_dict)
-        if not included:
+        return bool(self.filter_exps(filter))
+
+    def has_custom_filtering(self):
+        """
+        Whether filter_exps(...), exp_included(...) or group_included(...) are
+        overridden, in which case an ExpRegistry cannot index the group.
+        """
+        return (
+            type(self).filter_exps is not ExpGroup.filter_exps
+            or type(self).exp_included is not ExpGroup.exp_included
+            or type(self).group_included is not ExpGroup.group_included
+        )
+
+    def exp_resources(self, exp):
+        cores = exp.cores
+        if cores is None:
+            cores = exp.opts.get("cores", self.cores)
+        memory = exp.memory
+        if memory is None:
+            memory = exp.opts.get("memory", self.memory)
+        return {"cores": cores, "memory": memory}
+
+    def skip_target(self, exp, path_info, target, force, resume):
+        """
+        Whether an experiment can be skipped, either because the journal says
+        it was completed and resume is true or because its outputs are up to
+        date and force is false.
+        """
+        if resume and target.is_completed():
+            reason = "completed"
+        elif not force and target.is_current():
+            reason = "up to date"
+        else:
             return False
-        return any((self.exp_included(exp, filter) for exp in self.exps))
+        logger.info("Skipping %s on %s: %s", exp.nick, path_info.corpus, reason)
+        return True
 
-    def train_all(self, path_info, filter: SimpleFilter):
+    def train_tasks(self, path_info, filter: SimpleFilter, force=False, resume=False):
+        """
+        Tasks training each supervised experiment with a model which is not
+        up to date, or all of them if force is true. If resume is true,
+        experiments completed according to the journal are also skipped.
+        """
+        manifests = Manifests()
+        tasks = []
         for exp in self.filter_exps(filter):
-            if isinstance(exp, SupExp):
-                logger.info("Training %s", exp.nick)
-                exp.train_model(path_info)
+            if not isinstance(exp, SupExp):
+                continue
+            target = manifests.target(
+                "train",
+                mk_iden(path_info.corpus, exp),
+                exp.info(),
+                exp.train_inputs(path_info),
+                exp.train_outputs(path_info),
+            )
+            if self.skip_target(exp, path_info, target, force, resume):
+                continue
+            tasks.append(
+                Task(
+                    exp.nick,
+                    partial(exp.train_model, path_info),
+                    "Training",
+                    **target_callbacks([target]),
+                    **self.exp_resources(exp)
+                )
+            )
+        return tasks
 
-    def run_all(
-        self, path_info, filter: SimpleFilter, supress_exceptions=True, **extra
+    def run_tasks(
+        self, path_info, filter: SimpleFilter, force=False, resume=False, **extra
     ):
+        """
+        Tasks running each experiment with a guess which is not up to date, or
+        all of them if force is true. If resume is true, experiments completed
+        according to the journal are also skipped. path_info can also be a list of
+        path_infos, in which case each task runs an experiment on each corpus
+        in turn, so loaded models can be reused between corpora. When
+        group_at_once is set, a single task runs all of them with
+        run_group(...).
+        """
+        path_infos = path_info if isinstance(path_info, list) else [path_info]
+        manifests = Manifests()
+        pending = []
         for exp in self.filter_exps(filter):
+            for corpus_info in path_infos:
+                info = exp.info()
+                if extra:
+                    info = {**info, "extra": extra}
+                target = manifests.target(
+                    "run",
+                    mk_iden(corpus_info.corpus, exp),
+                    info,
+                    exp.run_inputs(corpus_info),
+                    exp.run_outputs(corpus_info),
+                )
+                if not self.skip_target(exp, corpus_info, target, force, resume):
+                    pending.append((exp, corpus_info, target))
+        if self.group_at_once and pending:
+            return [self.group_task(path_infos, pending, **extra)]
+        tasks = []
+        for exp, group in groupby(pending, key=lambda item: item[0]):
+            items = list(group)
+            corpus_infos = [corpus_info for _, corpus_info, _ in items]
+            if len(corpus_infos) == 1:
+                func = partial(exp.run_path_info, corpus_infos[0], **extra)
+            else:
+                func = partial(exp.run_path_infos, corpus_infos, **extra)
+            tasks.append(
+                Task(
+                    exp.nick,
+                    func,
+                    **target_callbacks([target for _, _, target in items]),
+                    **self.exp_resources(exp)
+                )
+            )
+        return tasks
+
+    def group_task(self, path_infos, pending, **extra):
+        batches = []
+        for corpus_info in path_infos:
+            exps = [exp for exp, info, _ in pending if info is corpus_info]
+            if exps:
+                batches.append((corpus_info, exps))
+        resources = [self.exp_resources(exp) for exp, _, _ in pending]
+
+        def run():
+            guess_paths = [
+                self.run_group(corpus_info, exps, **extra)
+                for corpus_info, exps in batches
+            ]
+            return guess_paths[0] if len(guess_paths) == 1 else guess_paths
+
+        return Task(
+            self.path_nick(),
+            run,
+            **target_callbacks([target for _, _, target in pending]),
+            cores=max(res["cores"] for res in resources),
+            memory=max(res["memory"] for res in resources),
+        )
+
+    def load_shared(self, path_info):
+        """
+        Load inputs shared by all experiments in the group, such as the corpus,
+        embeddings or tokenisers. Override along with run_group_exp(...).
+        """
+        return None
+
+    def run_group(self, path_info, exps, **extra):
+        """
+        Run exps one after another in this process after loading their shared
+        inputs once with load_shared(...). Each guess is written to its usual
+        path. Returns the guess paths.
+        """
+        shared = self.load_shared(path_info)
+        guess_paths = []
+        for exp in exps:
             logger.info("Running %s", exp.nick)
-            try:
-                measures = exp.run_path_info(path_info, **extra)
-            except Exception:
-                if supress_exceptions:
-                    traceback.print_exc()
-                    continue
-                else:
-                    raise
-            logger.info("Got %s", measures)
+            paths, guess_path, model_path, _ = exp.get_paths_from_path_info(
+                path_info
+            )
+            with measure_perf() as perf:
+                self.run_group_exp(
+                    exp, shared, paths, guess_path, model_path, **extra
+                )
+            record_run_perf(guess_path, model_path, perf)
+            guess_paths.append(guess_path)
+        return guess_paths
+
+    def run_group_exp(self, exp, shared, paths, guess_path, model_path, **extra):
+        """
+        Run a single experiment of run_group(...) given the result of
+        load_shared(...). By default shared is ignored.
+        """
+        return exp.run_dispatch(paths, guess_path, model_path, **extra)
+
+    def train_all(
+        self,
+        path_info,
+        filter: SimpleFilter,
+        exec_opts=None,
+        force=False,
+        resume=False,
+    ):
+        """
+        Train all supervised experiments which are not up to date. exec_opts
+        are passed to execute(...).
+        """
+        return execute(
+            self.train_tasks(path_info, filter, force, resume),
+            supress_exceptions=False,
+            **(exec_opts or {})
+        )
+
+    def run_all(
+        self,
+        path_info,
+        filter: SimpleFilter,
+        supress_exceptions=True,
+        exec_opts=None,
+        force=False,
+        resume=False,
+        **extra
+    ):
+        """
+        Run all experiments which are not up to date. exec_opts are passed to
+        execute(...) and extra to Exp.run_path_info(...).
+        """
+        return execute(
+            self.run_tasks(path_info, filter, force, resume, **extra),
+            supress_exceptions=supress_exceptions,
+            **(exec_opts or {})
+        )
 
     def path(self):
         cur_path = None
@@ -117,6 +367,27 @@ class ExpGroup:
         return ".".join((seg.lower() for seg in cur_path))
 
 
+def target_callbacks(targets):
+    """
+    The on_start, on_success and on_failure callbacks of a Task building
+    targets.
+    """
+
+    def on_start():
+        for target in targets:
+            target.start()
+
+    def on_success():
+        for target in targets:
+            target.record()
+
+    def on_failure(outcome):
+        for target in targets:
+            target.fail(outcome)
+
+    return {"on_start": on_start, "on_success": on_success, "on_failure": on_failure}
+
+
 class BoundExpGroup:
 
     def __init__(self, exp_group, filter: SimpleFilter):
@@ -128,12 +399,18 @@ def mk_bound_meth(meth_name):
 
     def meth(self, *args, **kwargs):
         kwargs["filter"] = self.filter
-        getattr(self.exp_group, meth_name)(*args, **kwargs)
+        return getattr(self.exp_group, meth_name)(*args, **kwargs)
 
     return meth
 
 
 for meth_name in [
-    "filter_exps", "exp_included", "group_included", "train_all", "run_all"
+    "filter_exps",
+    "exp_included",
+    "group_included",
+    "train_tasks",
+    "run_tasks",
+    "train_all",
+    "run_all",
 ]:
     setattr(BoundExpGroup, meth_name, mk_bound_meth(meth_name))
@@ -0,0 +1,128 @@
+"""
+Wall time, CPU time and peak memory of each stage of an experiment. These are
+kept in perf_dir() until proc_score(...) copies them into the result doc.
+"""
+import sys
+import json
+import time
+import tracemalloc
+from contextlib import contextmanager
+from expcomb.file_utils import atomic_write
+from expcomb.score_cache import cache_dir, path_entry
+
+try:
+    import resource
+
+    HAVE_RESOURCE = True
+except ImportError:  # pragma: no cover
+    HAVE_RESOURCE = False
+
+PERF_DIR_ENV_VAR = "EXPCOMB_PERF_DIR"
+PERF_SUFFIX = ".perf.json"
+# ru_maxrss is in bytes on macOS and kilobytes elsewhere
+MAXRSS_SCALE = 2 ** 20 if sys.platform == "darwin" else 2 ** 10
+
+
+def cpu_time():
+    if not HAVE_RESOURCE:
+        return time.process_time()
+    total = 0.0
+    for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN):
+        usage = resource.getrusage(who)
+        total += usage.ru_utime + usage.ru_stime
+    return total
+
+
+def max_rss():
+    if not HAVE_RESOURCE:
+        return None
+    return (
+        max(
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+        )
+        / MAXRSS_SCALE
+    )
+
+
+@contextmanager
+def measure_perf():
+    """
+    Measure the enclosed block. Yields a dict which is filled in on exit with
+    "wall" and "cpu" in seconds and "max_rss" in megabytes, plus
+    "traced_peak" in megabytes when tracemalloc is tracing on Python 3.9+.
+    CPU time includes child processes which have been waited for.
+
+    max_rss is the high water mark of the whole process, or its largest
+    waited for child, since it started. In a serial run it is therefore an
+    upper bound which can come from an earlier, bigger experiment. With
+    --jobs each experiment runs in its own forked worker, so it is only
+    inflated by the resident size of the parent at the time of the fork.
+    """
+    perf = {}
+    # The peak can only be reset from Python 3.9
+    tracing = tracemalloc.is_tracing() and hasattr(tracemalloc, "reset_peak")
+    if tracing:
+        tracemalloc.reset_peak()
+    wall_start = time.perf_counter()
+    cpu_start = cpu_time()
+    try:
+        yield perf
+    finally:
+        perf["wall"] = time.perf_counter() - wall_start
+        perf["cpu"] = cpu_time() - cpu_start
+        perf["max_rss"] = max_rss()
+        if tracing:
+            perf["traced_peak"] = tracemalloc.get_traced_memory()[1] / 2 ** 20
+
+
+def perf_dir():
+    """
+    The directory measurements are kept in. This is EXPCOMB_PERF_DIR if set,
+    otherwise a subdirectory of EXPCOMB_SCORE_CACHE if that is set, otherwise
+    expcomb/perf in the user cache directory.
+    """
+    return cache_dir(PERF_DIR_ENV_VAR, "perf")
+
+
+def perf_path(path):
+    return path_entry(perf_dir(), path.rstrip("/"), PERF_SUFFIX)
+
+
+def load_perf(path):
+    """
+    Load the measurements of each stage, e.g. {"train": {...}, "run": {...}},
+    of the model or guess at path, or an empty dict if there are none.
+    """
+    try:
+        with open(perf_path(path)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def dump_perf(path, perf):
+    with atomic_write(perf_path(path)) as f:
+        json.dump(perf, f, indent=1, sort_keys=True)
+
+
+def update_perf(path, **stages):
+    """
+    Replace the given stages of the measurements of path.
+    """
+    perf = load_perf(path)
+    perf.update(stages)
+    dump_perf(path, perf)
+
+
+def record_run_perf(guess_path, model_path, run_perf):
+    """
+    Keep the measurements of a run for its guess along with those of
+    training its model, if any.
+    """
+    stages = {"run": run_perf}
+    if model_path is not None:
+        train_perf = load_perf(model_path).get("train")
+        if train_perf is not None:
+            stages["train"] = train_perf
+    dump_perf(guess_path, stages)
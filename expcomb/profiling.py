@@ -0,0 +1,182 @@
+"""
+cProfile and sampled stack profiles of experiment runs.
+"""
+import io
+import os
+import signal
+import functools
+from collections import Counter
+from dataclasses import replace
+from os.path import join as pjoin, exists
+import click
+from expcomb import logger
+
+REPORT_NAME = "report.txt"
+
+
+def frame_name(frame):
+    code = frame.f_code
+    return "{}:{}:{}".format(
+        os.path.basename(code.co_filename), code.co_name, code.co_firstlineno
+    )
+
+
+class StackSampler:
+    """
+    Counts the call stacks seen whenever a SIGPROF is delivered. Only works
+    in the main thread of platforms with setitimer(...).
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.stacks = Counter()
+
+    def handle(self, signum, frame):
+        stack = []
+        while frame is not None:
+            stack.append(frame_name(frame))
+            frame = frame.f_back
+        self.stacks[";".join(reversed(stack))] += 1
+
+    def __enter__(self):
+        self.old_handler = signal.signal(signal.SIGPROF, self.handle)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+        return self
+
+    def __exit__(self, *exc):
+        signal.setitimer(signal.ITIMER_PROF, 0, 0)
+        signal.signal(signal.SIGPROF, self.old_handler)
+
+    def dump(self, path):
+        with open(path, "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write("{} {}\n".format(stack, count))
+
+
+def load_stacks(path):
+    stacks = Counter()
+    with open(path) as f:
+        for line in f:
+            stack, count = line.rsplit(" ", 1)
+            stacks[stack] += int(count)
+    return stacks
+
+
+class Profiler:
+    """
+    Dumps the cProfile stats of each experiment to <nick>.prof in out_dir,
+    the sampled stacks to <nick>.stacks in the format of flamegraph.pl, and a
+    report of the hottest functions to report.txt.
+    """
+
+    def __init__(self, out_dir, sample_interval=None, top=30):
+        self.out_dir = out_dir
+        self.sample_interval = sample_interval
+        self.top = top
+        self.nicks = []
+        os.makedirs(out_dir, exist_ok=True)
+
+    def prof_path(self, nick):
+        return pjoin(self.out_dir, nick + ".prof")
+
+    def stacks_path(self, nick):
+        return pjoin(self.out_dir, nick + ".stacks")
+
+    def wrap(self, nick, func):
+        """
+        Wrap func so that calling it profiles it as the experiment nick.
+        """
+        self.nicks.append(nick)
+
+        @functools.wraps(func)
+        def profiled(*args, **kwargs):
+            import cProfile
+
+            prof = cProfile.Profile()
+            sampler = None
+            if self.sample_interval is not None:
+                sampler = StackSampler(self.sample_interval).__enter__()
+            try:
+                return prof.runcall(func, *args, **kwargs)
+            finally:
+                if sampler is not None:
+                    sampler.__exit__()
+                    sampler.dump(self.stacks_path(nick))
+                prof.dump_stats(self.prof_path(nick))
+
+        return profiled
+
+    def wrap_tasks(self, tasks):
+        return [replace(task, func=self.wrap(task.nick, task.func)) for task in tasks]
+
+    def report(self):
+        """
+        Write the top functions by own time across all profiled experiments,
+        and the top sampled leaf functions if sampling, to report.txt.
+        """
+        prof_paths = [
+            self.prof_path(nick) for nick in self.nicks if exists(self.prof_path(nick))
+        ]
+        if not prof_paths:
+            return
+        import pstats
+
+        out = io.StringIO()
+        out.write("Profiled: {}\n\n".format(", ".join(self.nicks)))
+        stats = pstats.Stats(*prof_paths, stream=out)
+        stats.sort_stats("tottime").print_stats(self.top)
+        if self.sample_interval is not None:
+            leaves = Counter()
+            for nick in self.nicks:
+                if not exists(self.stacks_path(nick)):
+                    continue
+                for stack, count in load_stacks(self.stacks_path(nick)).items():
+                    leaves[stack.rsplit(";", 1)[-1]] += count
+            total = sum(leaves.values())
+            out.write("Sampled leaf functions ({} samples)\n\n".format(total))
+            for leaf, count in leaves.most_common(self.top):
+                out.write("{:8d} {:6.1%}  {}\n".format(count, count / total, leaf))
+        report_path = pjoin(self.out_dir, REPORT_NAME)
+        with open(report_path, "w") as f:
+            f.write(out.getvalue())
+        logger.info("Wrote profile report to %s", report_path)
+
+
+def profile_options(func):
+    """
+    Add options for profiling each experiment to a command.
+    """
+    options = [
+        click.option(
+            "--profile",
+            type=click.Path(file_okay=False),
+            help="Profile each experiment, writing <nick>.prof and a report here.",
+        ),
+        click.option(
+            "--profile-sample",
+            type=float,
+            help="Also sample call stacks every this many seconds of CPU time.",
+        ),
+        click.option(
+            "--profile-top",
+            type=int,
+            default=30,
+            help="Number of hot functions in the profile report.",
+        ),
+    ]
+    for option in reversed(options):
+        func = option(func)
+    return func
+
+
+def pop_profile_options(kwargs):
+    """
+    Take the options added by profile_options(...) out of kwargs, returning
+    a Profiler or None when not profiling.
+    """
+    out_dir = kwargs.pop("profile")
+    sample_interval = kwargs.pop("profile_sample")
+    top = kwargs.pop("profile_top")
+    if out_dir is None:
+        return None
+    return Profiler(out_dir, sample_interval, top)
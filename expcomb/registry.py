@@ -0,0 +1,213 @@
+"""
+An index over all experiments which answers filter queries quickly.
+"""
+from collections import defaultdict
+from .filter import SimpleFilter, empty_filter
+
+_UNHASHABLE = object()
+
+
+def hash_key(value):
+    """
+    A hashable key which is equal for two values when they compare equal, or
+    _UNHASHABLE. Unlike freeze(...), lists, tuples and dicts get different
+    keys, since they never compare equal to each other.
+    """
+    if isinstance(value, dict):
+        try:
+            items = sorted(value.items(), key=lambda item: item[0])
+        except TypeError:
+            return _UNHASHABLE
+        inner = tuple((k, hash_key(v)) for k, v in items)
+        if any(v is _UNHASHABLE for _, v in inner):
+            return _UNHASHABLE
+        return (dict, inner)
+    if isinstance(value, (list, tuple)):
+        inner = tuple(hash_key(v) for v in value)
+        if any(v is _UNHASHABLE for v in inner):
+            return _UNHASHABLE
+        return (list if isinstance(value, list) else tuple, inner)
+    try:
+        hash(value)
+    except TypeError:
+        return _UNHASHABLE
+    return value
+
+
+def filter_key(filter):
+    key = (tuple(filter.path), hash_key(filter.opt_dict))
+    if key[1] is _UNHASHABLE:
+        return None
+    return key
+
+
+class GroupIndex:
+    """
+    Indexes of the experiments of one group by path prefix and opt value.
+    Experiments are referred to by their position in the group.
+    """
+
+    def __init__(self, exp_group):
+        self.exp_group = exp_group
+        self.by_prefix = defaultdict(set)
+        self.by_path = defaultdict(set)
+        self.by_opt = defaultdict(lambda: defaultdict(set))
+        self.has_opt = defaultdict(set)
+        self.unindexed_opts = set()
+        for idx, exp in enumerate(exp_group.exps):
+            path = tuple(exp.path)
+            self.by_path[path].add(idx)
+            for end in range(len(path) + 1):
+                self.by_prefix[path[:end]].add(idx)
+            for opt, value in {"nick": exp.nick, **exp.opts}.items():
+                self.has_opt[opt].add(idx)
+                key = hash_key(value)
+                if key is _UNHASHABLE:
+                    self.unindexed_opts.add(opt)
+                else:
+                    self.by_opt[opt][key].add(idx)
+
+    def path_matches(self, filter_path):
+        # SimpleFilter.doc_included(...) zips the paths together, so an
+        # experiment path which is a prefix of the filter path also matches
+        matches = set(self.by_prefix.get(filter_path, ()))
+        for end in range(len(filter_path)):
+            matches |= self.by_path.get(filter_path[:end], set())
+        return matches
+
+    def opt_matches(self, opt, value, candidates):
+        exps = self.exp_group.exps
+        if opt in self.unindexed_opts:
+            return {
+                idx
+                for idx in candidates
+                if {"nick": exps[idx].nick, **exps[idx].opts}.get(opt) == value
+            }
+        key = hash_key(value)
+        if key is _UNHASHABLE:
+            return set()
+        matches = self.by_opt[opt].get(key, set())
+        if value is None:
+            # A missing opt compares equal to None
+            matches = matches | (candidates - self.has_opt[opt])
+        return candidates & matches
+
+    def filter_exps(self, filter):
+        included, opt_dict = self.exp_group.process_group_opts(filter.opt_dict)
+        if not included:
+            return []
+        candidates = self.path_matches(tuple(filter.path))
+        for opt, value in opt_dict.items():
+            if not candidates:
+                break
+            candidates = self.opt_matches(opt, value, candidates)
+        return [self.exp_group.exps[idx] for idx in sorted(candidates)]
+
+
+class ExpRegistry:
+    """
+    Memoises the result of each distinct filter. Experiments and groups must
+    not be changed once it has been built.
+    """
+
+    def __init__(self, experiments):
+        self.groups = list(experiments)
+        self.indexes = [
+            None if exp_group.has_custom_filtering() else GroupIndex(exp_group)
+            for exp_group in self.groups
+        ]
+        self.memo = {}
+
+    def __iter__(self):
+        return iter(self.groups)
+
+    def filtered_groups(self, filter):
+        """
+        A list of (group, included exps, group included) triples for each
+        group with at least one included experiment or which is included by
+        group_included(...). Memoised on the filter.
+        """
+        key = filter_key(filter)
+        if key is not None and key in self.memo:
+            return self.memo[key]
+        result = []
+        for exp_group, index in zip(self.groups, self.indexes):
+            if index is None:
+                exps = exp_group.filter_exps(filter)
+                group_included = exp_group.group_included(filter)
+            else:
+                exps = index.filter_exps(filter)
+                group_included = bool(exps)
+            if exps or group_included:
+                result.append((exp_group, exps, group_included))
+        if key is not None:
+            self.memo[key] = result
+        return result
+
+    def filter_experiments(self, filter):
+        for _, exps, _ in self.filtered_groups(filter):
+            yield from exps
+
+    def included_groups(self, filter):
+        for exp_group, _, group_included in self.filtered_groups(filter):
+            if group_included:
+                yield exp_group
+
+
+class SnakeMakeQueries:
+    """
+    Queries about experiments for use in Snakefiles, answered by an
+    ExpRegistry.
+    """
+
+    def __init__(self, registry):
+        self.registry = registry
+
+    def get_nicks(self, filter: SimpleFilter = empty_filter):
+        for exp in self.registry.filter_experiments(filter):
+            yield exp.nick
+
+    def intersect_nicks(self, filter, **kwargs):
+        if all(
+            (
+                k not in filter.opt_dict or filter.opt_dict[k] == v
+                for k, v in kwargs.items()
+            )
+        ):
+            yield from self.get_nicks(filter.intersect_opts(**kwargs))
+
+    def get_non_group_at_once_nicks(self, filter: SimpleFilter = empty_filter):
+        all_nicks = set(self.get_nicks(filter))
+        bad_nicks = self.get_group_at_once_nicks(filter)
+        return all_nicks - bad_nicks
+
+    def get_group_at_once_nicks(self, filter: SimpleFilter = empty_filter):
+        bad_nicks = set()
+        for exp_group in self.get_group_at_once_groups(filter):
+            for exp in exp_group.exps:
+                bad_nicks.add(exp.nick)
+        return bad_nicks
+
+    def get_group_at_once_groups(self, filter: SimpleFilter = empty_filter):
+        for exp_group in self.registry.included_groups(filter):
+            if exp_group.group_at_once:
+                yield exp_group
+
+    def get_group_at_once_map(self, filter: SimpleFilter = empty_filter):
+        res = {}
+        for exp_group in self.get_group_at_once_groups(filter):
+            res[exp_group.path_nick()] = exp_group
+        return res
+
+    def get_path_nick_map(self, filter: SimpleFilter = empty_filter):
+        res = {}
+        for exp_group in self.get_group_at_once_groups(filter):
+            res[exp_group.path_nick()] = exp_group.path()
+        return res
+
+    def get_nick_to_group_nick_map(self, filter: SimpleFilter = empty_filter):
+        res = {}
+        for exp_group in self.get_group_at_once_groups(filter):
+            for exp in exp_group.exps:
+                res[exp.nick] = exp_group.path_nick()
+        return res
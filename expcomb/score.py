@@ -1,13 +1,25 @@
 from time import time
 from tinyrecord import transaction
 from .utils import mk_iden
+from .score_cache import cached_score, default_cache
+from .perf import measure_perf, load_perf, update_perf
 from os.path import join as pjoin
 
 
-def calc_exp_score(exp, corpus, gold, guess, calc_score):
+def calc_exp_score(exp, corpus, gold, guess, calc_score, cache=None):
     iden = mk_iden(corpus, exp)
     guess_path = pjoin(guess, iden)
-    return calc_score(gold, guess_path)
+    if cache is None:
+        cache = default_cache()
+
+    def compute():
+        # Only measured when actually scored rather than read from the cache
+        with measure_perf() as perf:
+            measures = calc_score(gold, guess_path)
+        update_perf(guess_path, score=perf)
+        return measures
+
+    return cached_score(cache, compute, calc_score, gold, guess_path)
 
 
 def proc_score(exp, db, measures, guess, gold, **kwargs):
@@ -16,6 +28,10 @@ def proc_score(exp, db, measures, guess, gold, **kwargs):
     result["guess"] = guess
     result["gold"] = gold
     result["time"] = time()
+    if isinstance(guess, str):
+        perf = load_perf(guess)
+        if perf:
+            result["perf"] = perf
     result.update(kwargs)
 
     with transaction(db) as tr:
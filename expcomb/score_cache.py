@@ -0,0 +1,180 @@
+"""
+A persistent cache of scores, enabled by setting EXPCOMB_SCORE_CACHE to a
+directory.
+"""
+import os
+import pickle
+import hashlib
+import functools
+from types import FunctionType, MethodType
+from typing import Dict, Tuple
+from expcomb.file_utils import atomic_write
+
+CACHE_ENV_VAR = "EXPCOMB_SCORE_CACHE"
+HASH_CHUNK = 2 ** 20
+MISSING = object()
+
+_file_hashes: Dict[Tuple[str, int, int], str] = {}
+_default_cache = MISSING
+
+
+def file_hash(path):
+    """
+    The SHA-256 of the contents of the file at path. Memoised within the
+    process on the path, size and modification time of the file.
+    """
+    stat = os.stat(path)
+    memo_key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    if memo_key not in _file_hashes:
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK), b""):
+                digest.update(chunk)
+        _file_hashes[memo_key] = digest.hexdigest()
+    return _file_hashes[memo_key]
+
+
+def cache_dir(env_var, name):
+    """
+    The directory given by env_var if it is set, otherwise the subdirectory
+    name of EXPCOMB_SCORE_CACHE if that is set, otherwise expcomb/<name> in
+    the user cache directory.
+    """
+    path = os.environ.get(env_var)
+    if path:
+        return path
+    score_cache = os.environ.get(CACHE_ENV_VAR)
+    if score_cache:
+        return os.path.join(score_cache, name)
+    user_cache = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".cache"
+    )
+    return os.path.join(user_cache, "expcomb", name)
+
+
+def path_entry(directory, path, suffix):
+    """
+    The file in directory holding data about the file at path.
+    """
+    key = hashlib.sha256(os.path.abspath(path).encode("utf-8")).hexdigest()
+    return os.path.join(directory, key[:2], key[2:] + suffix)
+
+
+def qualified_name(obj):
+    if "<" in obj.__qualname__:
+        # A lambda or an object defined inside a function, which may be
+        # one of many made from the same code
+        return None
+    return obj.__module__ + "." + obj.__qualname__
+
+
+def scorer_id(scorer):
+    """
+    A string identifying scorer: its score_id if set, otherwise its qualified
+    name. None for lambdas, closures and instances with attributes but no
+    score_id, which may not be told apart.
+    """
+    ident = getattr(scorer, "score_id", None)
+    if ident is not None:
+        return ident
+    if isinstance(scorer, functools.partial):
+        func_id = scorer_id(scorer.func)
+        if func_id is None:
+            return None
+        return "{}{!r}".format(func_id, (scorer.args, sorted(scorer.keywords.items())))
+    if isinstance(scorer, MethodType):
+        self_id = scorer_id(scorer.__self__)
+        if self_id is None:
+            return None
+        return self_id + "." + scorer.__name__
+    if not isinstance(scorer, (FunctionType, type)):
+        if getattr(scorer, "__dict__", None) or getattr(scorer, "__slots__", None):
+            # Its attributes may affect the score
+            return None
+        scorer = type(scorer)
+    return qualified_name(scorer)
+
+
+class ScoreCache:
+    """
+    A directory containing one pickle per cached score.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def key(self, scorer, gold, guess, *extra):
+        ident = scorer_id(scorer)
+        if ident is None:
+            return None
+        try:
+            bits = (ident, file_hash(gold), file_hash(guess)) + extra
+        except OSError:
+            return None
+        return hashlib.sha256(repr(bits).encode("utf-8")).hexdigest()
+
+    def entry_path(self, key):
+        return os.path.join(self.path, key[:2], key[2:] + ".pkl")
+
+    def get(self, key):
+        try:
+            with open(self.entry_path(key), "rb") as f:
+                return pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return MISSING
+
+    def put(self, key, value):
+        with atomic_write(self.entry_path(key), "wb") as f:
+            pickle.dump(value, f)
+
+    def cached(self, compute, scorer, gold, guess, *extra):
+        key = self.key(scorer, gold, guess, *extra)
+        if key is None:
+            return compute()
+        value = self.get(key)
+        if value is MISSING:
+            value = compute()
+            self.put(key, value)
+        return value
+
+
+def default_cache():
+    """
+    The ScoreCache in the directory given by EXPCOMB_SCORE_CACHE or None if
+    it is not set.
+    """
+    global _default_cache
+    if _default_cache is MISSING:
+        path = os.environ.get(CACHE_ENV_VAR)
+        _default_cache = ScoreCache(path) if path else None
+    return _default_cache
+
+
+def cached_score(cache, compute, scorer, gold, guess, *extra):
+    """
+    Call compute() or get its result from cache if cache is not None and
+    scorer can be identified.
+    """
+    if cache is None:
+        return compute()
+    return cache.cached(compute, scorer, gold, guess, *extra)
+
+
+def cached_many(cache, compute_many, scorer, gold, guesses, *extra):
+    """
+    Like cached_score(...) for many guesses. compute_many(...) is only passed
+    the guesses which were not already cached.
+    """
+    if cache is None or scorer_id(scorer) is None:
+        return compute_many(guesses)
+    keys = [cache.key(scorer, gold, guess, *extra) for guess in guesses]
+    values = [MISSING if key is None else cache.get(key) for key in keys]
+    missing = [idx for idx, value in enumerate(values) if value is MISSING]
+    if missing:
+        computed = compute_many([guesses[idx] for idx in missing])
+        for idx, value in zip(missing, computed):
+            if keys[idx] is not None:
+                cache.put(keys[idx], value)
+            values[idx] = value
+    return values
@@ -1,14 +1,52 @@
+import os
 import numpy as np
 import pickle
 import click
-from memory_tempfile import MemoryTempfile
 from abc import ABC, abstractmethod
+from typing import Optional
 import functools
+from copy import copy
+from itertools import islice
+from expcomb import logger
 from expcomb.utils import TinyDBParam
 from expcomb.doc_utils import pk
-from tinyrecord import transaction
+from expcomb.score_cache import (
+    cached_many,
+    cached_score,
+    MISSING,
+    default_cache,
+    file_hash,
+)
+from expcomb.sigtest.lines import LineFile, count_lines
+from expcomb.sigtest.store import (
+    ComparedOutParam,
+    dump_resampled,
+    load_resampled,
+    unflatten_pairs,
+    write_compared,
+)
+
+# Maximum number of resampled differences held in memory at once by
+# compare_counts(...)
+COMPARE_BLOCK_ELEMS = 2 ** 22
+# Defaults for adaptive early stopping in resample_many(...)
+ADAPTIVE_BATCH_SIZE = 100
+ADAPTIVE_CI_Z = 2.576
+
+_memory_tempfile = None
+
+
+def memory_tempfile():
+    """
+    A MemoryTempfile, created on first use since creating it scans the
+    mounted filesystems.
+    """
+    global _memory_tempfile
+    if _memory_tempfile is None:
+        from memory_tempfile import MemoryTempfile
 
-tempfile = MemoryTempfile()
+        _memory_tempfile = MemoryTempfile()
+    return _memory_tempfile
 
 
 @click.group()
@@ -51,6 +89,103 @@ def read_schedule(schedule):
             break
 
 
+class ScheduleBatch(list):
+    """
+    A batch of resamples with indices in [start, stop) of schedule, if it
+    came from a ScheduleFile.
+    """
+
+    schedule = None
+    start = None
+    stop = None
+
+    @property
+    def schedule_key(self):
+        if self.schedule is None:
+            return None
+        return self.schedule.range_key(self.start, self.stop)
+
+
+class ScheduleFile:
+    """
+    A schedule as written by create-schedule. Iterating yields the resamples
+    with indices in [start, stop). The schedule_key identifies the contents
+    of the file and the range of iterations for the score cache. The file is
+    only hashed once the schedule_key is needed.
+    """
+
+    def __init__(self, f, start=0, stop=None):
+        self.f = f
+        self.start = start
+        self.stop = stop
+        self._digest = MISSING
+
+    @property
+    def digest(self):
+        if self._digest is MISSING:
+            self._digest = None
+            # Pipes can't be hashed without consuming them
+            if self.f.seekable():
+                try:
+                    self._digest = file_hash(self.f.name)
+                except (AttributeError, TypeError, OSError):
+                    pass
+        return self._digest
+
+    def range_key(self, start, stop):
+        if self.digest is None:
+            return None
+        return (self.digest, start, stop)
+
+    @property
+    def schedule_key(self):
+        return self.range_key(self.start, self.stop)
+
+    def limit(self, num):
+        stop = self.start + num
+        if self.stop is not None:
+            stop = min(stop, self.stop)
+        limited = copy(self)
+        limited.stop = stop
+        return limited
+
+    def __iter__(self):
+        if self.f.seekable():
+            self.f.seek(0)
+        return islice(read_schedule(self.f), self.start, self.stop)
+
+    def batches(self, batch_size):
+        resamples = iter(self)
+        start = self.start
+        while True:
+            batch = ScheduleBatch(islice(resamples, batch_size))
+            if not batch:
+                break
+            batch.schedule = self
+            batch.start = start
+            batch.stop = start + len(batch)
+            start += len(batch)
+            yield batch
+
+
+def limit_schedule(schedule, max_iters):
+    if isinstance(schedule, ScheduleFile):
+        return schedule.limit(max_iters)
+    return islice(schedule, max_iters)
+
+
+def schedule_batches(schedule, batch_size):
+    if isinstance(schedule, ScheduleFile):
+        yield from schedule.batches(batch_size)
+        return
+    schedule = iter(schedule)
+    while True:
+        batch = list(islice(schedule, batch_size))
+        if not batch:
+            break
+        yield batch
+
+
 def simple_resample(bootstrapper, extra_pk=None):
 
     @mk_resample
@@ -63,7 +198,7 @@ def simple_resample(bootstrapper, extra_pk=None):
         """
         Get many scores from resampled versions of the corpus.
         """
-        return bootstrapper, outf, gold, guess, result, read_schedule(
+        return bootstrapper, outf, gold, guess, result, ScheduleFile(
             schedule
         ), extra_pk
 
@@ -73,12 +208,87 @@ def resample_cmd_inner(bootstrapper, outf, gold, guess, result, schedule, extra_
     Get many scores from resampled versions of the corpus.
     """
     resampled = resample(bootstrapper, gold, guess, schedule)
+    dump_resampled_doc(outf, result, resampled, extra_pk)
+
+
+def dump_resampled_doc(outf, result, resampled, extra_pk):
     docs = list(result)
     assert len(docs) == 1
     output = dict(pk(docs[0], extra_pk))
-    output["resampled"] = resampled
     output["type"] = "resampled"
-    pickle.dump(output, outf)
+    output["iters"] = len(resampled[1])
+    dump_resampled(outf, output, resampled)
+
+
+def mk_resample_many(inner):
+
+    @click.option(
+        "--adaptive/--no-adaptive",
+        help="Stop early once every pair is confidently on one side of --thresh.",
+    )
+    @click.option("--thresh", type=float, default=0.05)
+    @click.option("--batch-size", type=int, default=ADAPTIVE_BATCH_SIZE)
+    @click.option("--max-iters", type=int, default=None)
+    @click.option(
+        "--ci-z",
+        type=float,
+        default=ADAPTIVE_CI_Z,
+        help="z-score of the confidence interval on each p value.",
+    )
+    @functools.wraps(inner)
+    def wrapper(ctx, *args, adaptive, thresh, batch_size, max_iters, ci_z, **kwargs):
+        bootstrapper, gold, systems, schedule, extra_pk = inner(*args, **kwargs)
+        if max_iters is not None:
+            schedule = limit_schedule(schedule, max_iters)
+        resample_many_cmd_inner(
+            bootstrapper,
+            gold,
+            systems,
+            schedule,
+            extra_pk,
+            thresh=thresh if adaptive else None,
+            batch_size=batch_size,
+            ci_z=ci_z,
+        )
+
+    return bootstrap.command("resample-many")(click.pass_context(wrapper))
+
+
+def simple_resample_many(bootstrapper, extra_pk=None):
+
+    @mk_resample_many
+    @click.argument("gold", type=click.Path())
+    @click.argument("schedule", type=click.File("rb"))
+    @click.option(
+        "--system",
+        "systems",
+        type=(click.Path(), TinyDBParam(), click.File("wb")),
+        multiple=True,
+        required=True,
+        help="A GUESS RESULT OUTF triple. May be given many times.",
+    )
+    def resample_many_cmd(gold, schedule, systems):
+        """
+        Get many scores from resampled versions of the corpus for many systems
+        at once, reading the schedule and gold only once.
+        """
+        return bootstrapper, gold, systems, ScheduleFile(schedule), extra_pk
+
+    return resample_many_cmd
+
+
+def resample_many_cmd_inner(
+    bootstrapper, gold, systems, schedule, extra_pk, **adaptive_kwargs
+):
+    """
+    Get many scores from resampled versions of the corpus for many systems.
+    """
+    guesses = [guess for guess, _, _ in systems]
+    all_resampled = resample_many(
+        bootstrapper, gold, guesses, schedule, **adaptive_kwargs
+    )
+    for (_, result, outf), resampled in zip(systems, all_resampled):
+        dump_resampled_doc(outf, result, resampled, extra_pk)
 
 
 def mk_compare_resampled(inner):
@@ -95,7 +305,7 @@ def simple_compare_resampled():
 
     @mk_compare_resampled
     @click.argument("docs", type=click.File("rb"), nargs=-1, required=True)
-    @click.argument("outf", type=TinyDBParam())
+    @click.argument("outf", type=ComparedOutParam())
     def res(docs, outf):
         return docs, outf
 
@@ -103,50 +313,131 @@ def simple_compare_resampled():
 
 
 def compare_resampled_inner(docs, outf):
-    docs = [pickle.load(doc) for doc in docs]
+    """
+    Compare all pairs of resampled docs and write the result with
+    write_compared(...).
+    """
+    docs = [load_resampled(doc) for doc in docs]
     resamples = []
     for doc in docs:
         resamples.append(doc["resampled"])
         del doc["resampled"]
+        # Only recorded once for the whole comparison so that the docs keep
+        # matching pk(...) of their result docs
+        doc.pop("iters", None)
     assert len(resamples) >= 1
     orig_f1s, resampled_f1s = zip(*resamples)
-    result = compare_f1s(orig_f1s, resampled_f1s)
-    with transaction(outf) as tr:
-        tr.insert(
-            {
-                "type": "compared",
-                "docs": docs,
-                "compared": result,
-                "orig-scores": orig_f1s,
-            }
-        )
+    # Adaptively resampled docs may have different numbers of iterations
+    iters = min(len(dist) for dist in resampled_f1s)
+    resampled_f1s = [dist[:iters] for dist in resampled_f1s]
+    b_bigger, p_vals = compare_f1s_flat(orig_f1s, resampled_f1s)
+    write_compared(outf, docs, orig_f1s, b_bigger, p_vals, iters)
 
 
 class Bootstrapper(ABC):
+    # Identifies the scorer in score cache keys. Instances with attributes are
+    # only cached when this is set, since they may affect the score.
+    score_id: Optional[str] = None
 
     @abstractmethod
     def score_one(self, gold, guess):
         pass
 
+    def score_cache(self):
+        """
+        The ScoreCache to use, if any. Defaults to the one configured by the
+        EXPCOMB_SCORE_CACHE environment variable.
+        """
+        return default_cache()
+
+    def cached_score_one(self, gold, guess):
+        return cached_score(
+            self.score_cache(), lambda: self.score_one(gold, guess), self, gold, guess
+        )
+
+    def cached_score_many(self, gold, guesses):
+        return cached_many(
+            self.score_cache(),
+            lambda guesses: self.score_many(gold, guesses),
+            self,
+            gold,
+            guesses,
+        )
+
+    def dist_cache(self, schedule):
+        """
+        Score distributions are only cached when the schedule can be
+        identified, e.g. when it is a ScheduleFile.
+        """
+        cache = self.score_cache()
+        if cache is None:
+            return None, None
+        schedule_key = getattr(schedule, "schedule_key", None)
+        if schedule_key is None:
+            return None, None
+        return cache, ("dist",) + schedule_key
+
     def create_score_dist(self, gold, guess, schedule):
-        guess_lines = open(guess).readlines()
+        cache, dist_key = self.dist_cache(schedule)
+        return cached_score(
+            cache,
+            lambda: self.uncached_score_dist(gold, guess, schedule),
+            self,
+            gold,
+            guess,
+            *(dist_key or ())
+        )
 
+    def uncached_score_dist(self, gold, guess, schedule):
         dist = []
-        boot = tempfile.NamedTemporaryFile("w+")
-        for resample in schedule:
-            boot.seek(0)
-            boot.truncate()
-            for sample_idx in resample:
-                boot.write(guess_lines[sample_idx])
-            boot.flush()
-            dist.append(self.score_one(gold, boot.name))
+        boot = memory_tempfile().NamedTemporaryFile("wb")
+        with LineFile(guess) as guess_lines:
+            for resample in schedule:
+                write_resample(boot, guess_lines, resample)
+                dist.append(self.score_one(gold, boot.name))
         return dist
 
-    def create_schedule(self, gold, bootstrap_iters=1000, seed=None):
-        return self.create_schedule_from_size(
-            len(open(gold).readlines()), bootstrap_iters, seed
+    def score_many(self, gold, guesses):
+        """
+        Score many guesses against the same gold. Override this when the
+        underlying scorer can score a batch of guesses in one go.
+        """
+        return [self.score_one(gold, guess) for guess in guesses]
+
+    def create_score_dists(self, gold, guesses, schedule):
+        """
+        Like create_score_dist(...) but for many guesses, iterating the
+        schedule only once.
+        """
+        cache, dist_key = self.dist_cache(schedule)
+        return cached_many(
+            cache,
+            lambda guesses: self.uncached_score_dists(gold, guesses, schedule),
+            self,
+            gold,
+            guesses,
+            *(dist_key or ())
         )
 
+    def uncached_score_dists(self, gold, guesses, schedule):
+        guess_lines = [LineFile(guess) for guess in guesses]
+        dists = [[] for _ in guesses]
+        boots = [memory_tempfile().NamedTemporaryFile("wb") for _ in guesses]
+        try:
+            for resample in schedule:
+                for lines, boot in zip(guess_lines, boots):
+                    write_resample(boot, lines, resample)
+                scores = self.score_many(gold, [boot.name for boot in boots])
+                for dist, score in zip(dists, scores):
+                    dist.append(score)
+        finally:
+            for lines in guess_lines:
+                lines.close()
+        return dists
+
+    def create_schedule(self, gold, bootstrap_iters=1000, seed=None):
+        return self.create_schedule_from_size(count_lines(gold), bootstrap_iters, seed)
+
     def create_schedule_from_size(self, size, bootstrap_iters=1000, seed=None):
         if seed is not None:
             np.random.seed(seed)
@@ -157,22 +448,28 @@ class Bootstrapper(ABC):
 def mk_bootstrap_score(get_score):
 
     def bootstrap_score(gold, guess, schedule):
-        guess_lines = open(guess).readlines()
-
         f1s = []
-        boot = tempfile.NamedTemporaryFile("w+")
-        for resample in schedule:
-            boot.seek(0)
-            boot.truncate()
-            for sample_idx in resample:
-                boot.write(guess_lines[sample_idx])
-            boot.flush()
-            f1s.append(get_score(gold, boot.name))
+        boot = memory_tempfile().NamedTemporaryFile("wb")
+        with LineFile(guess) as guess_lines:
+            for resample in schedule:
+                write_resample(boot, guess_lines, resample)
+                f1s.append(get_score(gold, boot.name))
         return f1s
 
     return bootstrap_score
 
 
+def write_resample(boot, guess_lines, resample):
+    """
+    Replace the contents of the temporary file boot with the lines of
+    guess_lines picked out by resample.
+    """
+    fd = boot.fileno()
+    os.lseek(fd, 0, os.SEEK_SET)
+    os.ftruncate(fd, 0)
+    guess_lines.write_sample(fd, resample)
+
+
 def pair_f1s(orig_f1_a, orig_f1_b, f1s_a, f1s_b):
     sample_diff = orig_f1_b - orig_f1_a
     if sample_diff < 0:
@@ -208,20 +505,123 @@ class IterPairs:
 
 
 def resample(bootstrapper, gold, guess, schedule):
-    orig_score = bootstrapper.score_one(gold, guess)
+    orig_score = bootstrapper.cached_score_one(gold, guess)
     resampled_score = bootstrapper.create_score_dist(gold, guess, schedule)
     return orig_score, resampled_score
 
 
+def resample_many(
+    bootstrapper,
+    gold,
+    guesses,
+    schedule,
+    thresh=None,
+    batch_size=ADAPTIVE_BATCH_SIZE,
+    ci_z=ADAPTIVE_CI_Z,
+):
+    """
+    Get the original and resampled scores of many guesses. When thresh is
+    given, resampling is done in batches of batch_size iterations and stops
+    as soon as pvals_settled(...) is true for every pair of guesses.
+    """
+    orig_scores = bootstrapper.cached_score_many(gold, guesses)
+    if thresh is None:
+        resampled_scores = bootstrapper.create_score_dists(gold, guesses, schedule)
+        return list(zip(orig_scores, resampled_scores))
+    orig_arr = np.asarray(orig_scores, dtype=np.float64)
+    resampled_scores = [[] for _ in guesses]
+    counts = None
+    iters = 0
+    for batch in schedule_batches(schedule, batch_size):
+        batch_scores = bootstrapper.create_score_dists(gold, guesses, batch)
+        for dist, batch_dist in zip(resampled_scores, batch_scores):
+            dist.extend(batch_dist)
+        _, batch_counts = compare_counts(
+            orig_arr, np.asarray(batch_scores, dtype=np.float64)
+        )
+        counts = batch_counts if counts is None else counts + batch_counts
+        iters += len(batch)
+        settled = pvals_settled(counts, iters, thresh, ci_z)
+        logger.info(
+            "%s iterations: %s/%s pairs settled", iters, settled.sum(), len(settled)
+        )
+        if settled.all():
+            break
+    return list(zip(orig_scores, resampled_scores))
+
+
+def pvals_settled(counts, iters, thresh, ci_z=ADAPTIVE_CI_Z):
+    """
+    Check whether the Wilson score interval of each p value estimated as
+    counts / iters lies entirely on one side of thresh.
+    """
+    p_vals = counts / iters
+    z2 = ci_z * ci_z
+    denom = 1 + z2 / iters
+    centre = (p_vals + z2 / (2 * iters)) / denom
+    half_width = (
+        ci_z * np.sqrt(p_vals * (1 - p_vals) / iters + z2 / (4 * iters * iters))
+    ) / denom
+    return (centre + half_width <= thresh) | (centre - half_width > thresh)
+
+
+def compare_counts(
+    orig_f1s, resampled_f1s, block_elems=COMPARE_BLOCK_ELEMS, progress=None
+):
+    """
+    Vectorised version of pair_f1s(...) over all pairs of systems. Takes a
+    vector of original scores and a (systems x iters) array of resampled
+    scores. Returns whether b is bigger and the number of resamples where the
+    difference is more than twice the original difference as two vectors in
+    the same order as IterPairs. Pairs are processed in blocks of around
+    block_elems resampled differences to bound memory usage.
+    """
+    num_systems, iters = resampled_f1s.shape
+    num_pairs = num_systems * (num_systems - 1) // 2
+    b_bigger = np.empty(num_pairs, dtype=bool)
+    counts = np.empty(num_pairs, dtype=np.int64)
+    block_size = max(1, block_elems // max(iters, 1))
+    pair_idx = 0
+    for idx_a in range(num_systems):
+        for start in range(idx_a + 1, num_systems, block_size):
+            stop = min(start + block_size, num_systems)
+            sample_diff = orig_f1s[start:stop] - orig_f1s[idx_a]
+            block_b_bigger = sample_diff >= 0
+            sign = np.where(block_b_bigger, 1.0, -1.0)
+            resampled_diff = (resampled_f1s[start:stop] - resampled_f1s[idx_a]) * sign[
+                :, np.newaxis
+            ]
+            threshold = 2 * np.abs(sample_diff)[:, np.newaxis]
+            block_end = pair_idx + stop - start
+            b_bigger[pair_idx:block_end] = block_b_bigger
+            counts[pair_idx:block_end] = np.count_nonzero(
+                resampled_diff > threshold, axis=1
+            )
+            pair_idx = block_end
+            if progress is not None:
+                progress(stop - start)
+    return b_bigger, counts
+
+
+def compare_f1s_flat(orig_f1s, resampled_f1s):
+    """
+    Like compare_f1s(...) but returns vectors of b_bigger and p values in
+    IterPairs order.
+    """
+    orig_f1s = np.asarray(orig_f1s, dtype=np.float64)
+    resampled_f1s = np.asarray(resampled_f1s, dtype=np.float64)
+    pairs_ctx = click.progressbar(
+        length=len(IterPairs(orig_f1s)), label="Comparing pairs", show_pos=True
+    )
+    with pairs_ctx as bar:
+        b_bigger, counts = compare_counts(
+            orig_f1s, resampled_f1s, progress=bar.update
+        )
+    return b_bigger, counts / resampled_f1s.shape[1]
+
+
 def compare_f1s(orig_f1s, resampled_f1s):
-    iter_pairs = IterPairs(list(zip(orig_f1s, resampled_f1s)))
-    pairs_ctx = click.progressbar(iter_pairs, label="Comparing pairs", show_pos=True)
-    result = [[] for _ in orig_f1s]
-    with pairs_ctx as pairs:
-        for idx, (orig_f1_a, f1s_a), (orig_f1_b, f1s_b) in pairs:
-            b_bigger, p_val = pair_f1s(orig_f1_a, orig_f1_b, f1s_a, f1s_b)
-            result[idx].append((b_bigger, p_val))
-    return result
+    return unflatten_pairs(*compare_f1s_flat(orig_f1s, resampled_f1s))
 
 
 if __name__ == "__main__":
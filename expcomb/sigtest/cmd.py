@@ -1,8 +1,10 @@
 import click
 from expcomb.sigtest.bootstrap import bootstrap
 from expcomb.sigtest.disp import disp
+from expcomb.sigtest.randomise import randomise
 
 
 merged = click.CommandCollection(
-    sources=[bootstrap, disp], help="Commands for significance testing of guess"
+    sources=[bootstrap, randomise, disp],
+    help="Commands for significance testing of guess",
 )
@@ -1,10 +1,35 @@
+import os
 import click
+import functools
+from os.path import basename, join as pjoin, splitext
+from subprocess import run
 from expcomb import logger
-from expcomb.utils import TinyDBParam
+from expcomb.utils import (
+    TinyDBParam,
+    sweep_doc_included,
+    sweep_options,
+    sweep_selection,
+    warn_skipped_sweep_docs,
+)
+from expcomb.sigtest.store import (
+    CompactCompared,
+    CondensedPairs,
+    PairsInParam,
+    open_pairs_in,
+)
 from tinyrecord import transaction
-from networkx import DiGraph, Graph
-from networkx.algorithms.clique import find_cliques
+import numpy as np
 from collections import Counter
+from multiprocessing import Pool
+from tinydb import TinyDB
+from expcomb.doc_utils import iter_db_paths
+
+
+# Maximum number of letters built with insert-absorb before falling back to a
+# greedy clique cover
+MAX_CLD_COLUMNS = 256
+# Keys ignored when counting highlights across databases
+UNKEYED_HIGHLIGHT = ("gold", "test-corpus", "train-corpus")
 
 
 @click.group()
@@ -32,38 +57,212 @@ def iter_all_pairs_cmp(pvalmat):
             yield idx_a, idx_b, b_bigger, p_val
 
 
+def condensed_pairs(pvalmat):
+    """
+    Get vectors of b_bigger and p values in the order of
+    iter_all_pairs_cmp(...) from either kind of p value matrix.
+    """
+    if isinstance(pvalmat, CondensedPairs):
+        return np.asarray(pvalmat.b_bigger, dtype=bool), np.asarray(pvalmat.p_vals)
+    cmps = [cmp for row in pvalmat for cmp in row]
+    b_bigger = np.array([bool(b_bigger) for b_bigger, _ in cmps], dtype=bool)
+    p_vals = np.array([p_val for _, p_val in cmps], dtype=np.float64)
+    return b_bigger, p_vals
+
+
 def mk_sd_graph(pvalmat, thresh=0.05):
     """
-    Make a graph with edges as signifcant differences between treatments.
+    Make a boolean adjacency matrix with edges as signifcant differences
+    between treatments, pointing towards the better treatment.
     """
-    digraph = DiGraph()
-    for idx in range(len(pvalmat)):
-        digraph.add_node(idx)
-    for idx_a, idx_b, b_bigger, p_val in iter_all_pairs_cmp(pvalmat):
-        if p_val > thresh:
-            continue
-        if b_bigger:
-            digraph.add_edge(idx_a, idx_b)
-        else:
-            digraph.add_edge(idx_b, idx_a)
-    return digraph
+    num = len(pvalmat)
+    b_bigger, p_vals = condensed_pairs(pvalmat)
+    idx_a, idx_b = np.triu_indices(num, 1)
+    sig = p_vals <= thresh
+    adj = np.zeros((num, num), dtype=bool)
+    adj[
+        np.where(b_bigger, idx_a, idx_b)[sig], np.where(b_bigger, idx_b, idx_a)[sig]
+    ] = True
+    return adj
 
 
 def mk_nsd_graph(pvalmat, thresh=0.05):
     """
-    Make a graph with edges as non signifcant differences between treatments.
+    Make a symmetric boolean adjacency matrix with edges as non signifcant
+    differences between treatments.
+    """
+    num = len(pvalmat)
+    _, p_vals = condensed_pairs(pvalmat)
+    idx_a, idx_b = np.triu_indices(num, 1)
+    nsd = p_vals > thresh
+    adj = np.zeros((num, num), dtype=bool)
+    adj[idx_a[nsd], idx_b[nsd]] = True
+    adj[idx_b[nsd], idx_a[nsd]] = True
+    return adj
+
+
+def iter_sig_pairs(pvalmat, thresh=0.05):
+    _, p_vals = condensed_pairs(pvalmat)
+    idx_a, idx_b = np.triu_indices(len(pvalmat), 1)
+    sig = p_vals <= thresh
+    return zip(idx_a[sig].tolist(), idx_b[sig].tolist())
+
+
+def iter_bits(bitset):
+    idx = 0
+    while bitset:
+        if bitset & 1:
+            yield idx
+        bitset >>= 1
+        idx += 1
+
+
+class TooManyColumns(Exception):
+    pass
+
+
+def insert_absorb(num_treatments, sig_pairs, columns=None, max_columns=None):
+    """
+    The insert-absorb algorithm of Piepho (2004) for building a CLD. Each
+    column of the CLD is a bitset of the treatments sharing its letter.
+    Starting from a single column containing every treatment (or the given
+    columns), each significantly different pair which shares a column causes
+    it to be split into one column without each treatment of the pair. New
+    columns which are contained in some other column are then absorbed.
+
+    The result is the maximal cliques of the graph of pairs which are not
+    significantly different, of which there can be exponentially many, e.g.
+    2^k for k disjoint significant pairs. TooManyColumns is raised as soon as
+    there are more than max_columns.
     """
-    graph = Graph()
-    for idx in range(len(pvalmat)):
-        graph.add_node(idx)
-    for idx_a, idx_b, b_bigger, p_val in iter_all_pairs_cmp(pvalmat):
-        if p_val <= thresh:
+    if columns is None:
+        columns = [(1 << num_treatments) - 1] if num_treatments else []
+    for idx_a, idx_b in sig_pairs:
+        pair = (1 << idx_a) | (1 << idx_b)
+        kept = []
+        split = []
+        for column in columns:
+            if column & pair == pair:
+                split.append(column & ~(1 << idx_a))
+                split.append(column & ~(1 << idx_b))
+            else:
+                kept.append(column)
+        if not split:
             continue
-        graph.add_edge(idx_a, idx_b)
-    return graph
+        # Only new columns can be contained in others since the old columns
+        # were not contained in each other nor in the columns they were split
+        # from.
+        split.sort(key=popcount, reverse=True)
+        for column in split:
+            if not any(column & other == column for other in kept):
+                kept.append(column)
+        columns = kept
+        if max_columns is not None and len(columns) > max_columns:
+            raise TooManyColumns(len(columns))
+    return columns
+
+
+def clique_cover(num_treatments, sig_pairs):
+    """
+    A greedy heuristic in the spirit of the clique cover heuristic of Gramm
+    et al. (2006). Each pair of treatments which is not significantly
+    different and not yet covered starts a new column, which is grown one
+    treatment at a time, picking whichever covers the most uncovered pairs.
+    Treatments with no such pairs get a column of their own. Takes
+    O(p * n^2) bitset operations for n treatments and p pairs which are not
+    significantly different, but the columns need not be minimal.
+    """
+    everyone = (1 << num_treatments) - 1
+    adj = [everyone & ~(1 << idx) for idx in range(num_treatments)]
+    for idx_a, idx_b in sig_pairs:
+        adj[idx_a] &= ~(1 << idx_b)
+        adj[idx_b] &= ~(1 << idx_a)
+    uncovered = list(adj)
+    columns = [1 << idx for idx in range(num_treatments) if not adj[idx]]
+    for idx_a in range(num_treatments):
+        while uncovered[idx_a]:
+            idx_b = lowest_bit(uncovered[idx_a])
+            column = (1 << idx_a) | (1 << idx_b)
+            candidates = adj[idx_a] & adj[idx_b]
+            while candidates:
+                best = max(
+                    iter_bits(candidates),
+                    key=lambda elem: popcount(uncovered[elem] & column),
+                )
+                column |= 1 << best
+                candidates &= adj[best]
+            for elem in iter_bits(column):
+                uncovered[elem] &= ~column
+            columns.append(column)
+    return columns
+
+
+def cld_columns(num_treatments, sig_pairs, max_columns=None):
+    """
+    The swept columns of a CLD, from insert_absorb(...) unless it would need
+    more than max_columns, in which case from clique_cover(...).
+    """
+    sig_pairs = list(sig_pairs)
+    try:
+        columns = insert_absorb(num_treatments, sig_pairs, max_columns=max_columns)
+    except TooManyColumns:
+        warn_fallback(max_columns)
+        columns = clique_cover(num_treatments, sig_pairs)
+    return sweep(columns)
+
+
+def warn_fallback(max_columns):
+    logger.warning(
+        "Insert-absorb needs more than %s columns. "
+        "Falling back to a greedy clique cover.",
+        max_columns,
+    )
+
+
+def sweep(columns):
+    """
+    The sweeping step of Piepho (2004). Removes a treatment from a column
+    whenever every pair it forms within the column is also covered by some
+    other column, and then drops columns which become empty. The treatment
+    must also have another letter. Columns are swept in a canonical order so
+    that the result does not depend on the order pairs were inserted in.
+    """
+    columns = sorted(columns)
+    # The indices of the columns containing each treatment
+    containing = {}
+    for col_idx, column in enumerate(columns):
+        for elem in iter_bits(column):
+            containing.setdefault(elem, set()).add(col_idx)
+    for col_idx in range(len(columns)):
+        for elem in list(iter_bits(columns[col_idx])):
+            if len(containing[elem]) < 2:
+                continue
+            bit = 1 << elem
+            rest = columns[col_idx] & ~bit
+            covered = 0
+            for other_idx in containing[elem]:
+                if other_idx != col_idx:
+                    covered |= columns[other_idx]
+            if rest & ~covered == 0:
+                columns[col_idx] = rest
+                containing[elem].discard(col_idx)
+    return [column for column in columns if column]
+
+
+def lowest_bit(bitset):
+    return (bitset & -bitset).bit_length() - 1
+
+
+def popcount(bitset):
+    return bin(bitset).count("1")
 
 
 def load_pairs_in(pairs_in):
+    if isinstance(pairs_in, CompactCompared):
+        docs = pairs_in.docs
+        for doc in docs:
+            doc.pop("type", None)
+        return pairs_in.pvalmat, pairs_in.orig_scores, docs
     pairs_in = list(pairs_in)
     assert len(pairs_in) == 1
     pairs_in = pairs_in[0]
@@ -75,32 +274,131 @@ def load_pairs_in(pairs_in):
     return pvalmat, orig_scores, docs
 
 
+def topological_order(adj):
+    """
+    Order the nodes of a DAG given as a boolean adjacency matrix so that
+    every edge points forwards.
+    """
+    indegree = adj.sum(axis=0)
+    ready = np.flatnonzero(indegree == 0).tolist()
+    order = []
+    while ready:
+        node = ready.pop()
+        order.append(node)
+        for child in np.flatnonzero(adj[node]).tolist():
+            indegree[child] -= 1
+            if indegree[child] == 0:
+                ready.append(child)
+    if len(order) != len(adj):
+        raise ValueError("Significance graph contains a cycle")
+    return order
+
+
+def transitive_reduction(adj):
+    """
+    Transitive reduction of a DAG given as a boolean adjacency matrix. Nodes
+    are visited in reverse topological order, building a bitset of the
+    descendants of each node. An edge is removed when its target is already
+    a descendant of another child of its source.
+    """
+    children = [np.flatnonzero(row).tolist() for row in adj]
+    descendants = [0] * len(adj)
+    reduced = np.zeros_like(adj)
+    for node in reversed(topological_order(adj)):
+        covered = 0
+        for child in children[node]:
+            covered |= descendants[child]
+        node_descendants = covered
+        for child in children[node]:
+            node_descendants |= 1 << child
+            if not (covered >> child) & 1:
+                reduced[node, child] = True
+        descendants[node] = node_descendants
+    return reduced
+
+
+def hasse_dot(adj, orig_scores):
+    lines = ["digraph hasse {"]
+    for idx, score in enumerate(orig_scores):
+        lines.append(f'  {idx} [label="{idx}: {score:.4g}"];')
+    for idx_a, idx_b in zip(*np.nonzero(adj)):
+        lines.append(f"  {idx_a} -> {idx_b};")
+    lines.append("}\n")
+    return "\n".join(lines)
+
+
 @disp.command("hasse")
-@click.argument("pairs-in", type=TinyDBParam())
+@click.argument("pairs-in", type=click.Path(exists=True), nargs=-1, required=True)
 @click.option("--thresh", type=float, default=0.05)
-def hasse(pairs_in, thresh):
+@click.option(
+    "--out-dir",
+    type=click.Path(file_okay=False),
+    help="Write diagrams here instead of showing them.",
+)
+@click.option(
+    "--format",
+    "fmt",
+    type=click.Choice(["dot", "svg", "pdf", "png"]),
+    default="svg",
+    help="Format of diagrams written to --out-dir. All but dot need Graphviz.",
+)
+def hasse(pairs_in, thresh, out_dir, fmt):
     """
     Draw a hasse diagram showing which treatments/expcombs have significantly
     differences from each other.
     """
-    from networkx.algorithms.dag import transitive_reduction
+    if out_dir is None:
+        out_paths = [None] * len(pairs_in)
+    else:
+        os.makedirs(out_dir, exist_ok=True)
+        out_paths = [
+            pjoin(out_dir, splitext(basename(path))[0] + "." + fmt)
+            for path in pairs_in
+        ]
+        if len(set(out_paths)) < len(out_paths):
+            raise click.UsageError("Inputs must have distinct base names")
+    for path, out_path in zip(pairs_in, out_paths):
+        pvalmat, orig_scores, docs = load_pairs_in(open_pairs_in(path))
+        reduced = transitive_reduction(mk_sd_graph(pvalmat, thresh))
+        if out_path is None:
+            show_hasse(reduced)
+            continue
+        dot = hasse_dot(reduced, orig_scores)
+        if fmt == "dot":
+            with open(out_path, "w") as outf:
+                outf.write(dot)
+        else:
+            run(["dot", "-T" + fmt, "-o", out_path], input=dot.encode(), check=True)
+        logger.info("Wrote %s", out_path)
+
+
+def show_hasse(reduced):
+    from networkx import DiGraph, from_numpy_array
     from networkx.drawing.nx_pylab import draw_networkx
     from networkx.drawing.nx_agraph import graphviz_layout
     import matplotlib.pyplot as plt
 
-    pvalmat, orig_scores, docs = load_pairs_in(pairs_in)
-    digraph = mk_sd_graph(pvalmat, thresh)
-    digraph = transitive_reduction(digraph)
+    digraph = from_numpy_array(reduced, create_using=DiGraph)
     layout = graphviz_layout(digraph, prog="dot")
     draw_networkx(digraph, pos=layout)
     plt.show()
 
 
+def max_columns_option(func):
+    return click.option(
+        "--max-columns",
+        type=int,
+        default=MAX_CLD_COLUMNS,
+        help="Fall back to a greedy clique cover beyond this many letters.",
+    )(func)
+
+
 @disp.command("cld")
-@click.argument("pairs-in", type=TinyDBParam())
+@click.argument("pairs-in", type=PairsInParam())
 @click.argument("db", type=TinyDBParam())
 @click.option("--thresh", type=float, default=0.05)
-def cld(pairs_in, db, thresh):
+@max_columns_option
+def cld(pairs_in, db, thresh, max_columns):
     """
     Create a Compact Letter Display (CLD) grouping together treatments/expcombs
     which have no significant difference. See:
@@ -115,14 +413,27 @@ def cld(pairs_in, db, thresh):
     Evaluation Jens Gramm
 
     http://www.akt.tu-berlin.de/fileadmin/fg34/publications-akt/letter-displays-csda06.pdf
+
+    The letters are built with the insert-absorb algorithm of Piepho, which
+    finds every maximal group of treatments with no significant differences.
+    There can be exponentially many such groups, e.g. 2^k for k disjoint
+    significant pairs, so beyond --max-columns a polynomial time greedy
+    clique cover is used instead, which may use more letters than needed.
     """
     pvalmat, orig_scores, docs = load_pairs_in(pairs_in)
 
-    graph = mk_nsd_graph(pvalmat, thresh)
+    columns = cld_columns(
+        len(pvalmat), iter_sig_pairs(pvalmat, thresh), max_columns=max_columns
+    )
+    with transaction(db) as tr:
+        tr.insert(cld_doc(columns, orig_scores, docs))
+
+
+def cld_doc(columns, orig_scores, docs):
     res = {}
 
     cliques = sorted(
-        find_cliques(graph),
+        (list(iter_bits(column)) for column in columns),
         key=lambda clique: -max((orig_scores[elem] for elem in clique)),
     )
 
@@ -134,22 +445,79 @@ def cld(pairs_in, db, thresh):
     logger.info(
         "\n".join(f"{elem}: {letters}" for elem, letters in sorted(res.items()))
     )
+    res_len = len(res.keys())
+    letters = [res[idx] for idx in range(res_len)]
+    assert len(letters) == len(docs)
+    return {
+        "type": "cld-label",
+        "orig-scores": orig_scores,
+        "docs": docs,
+        "letters": letters,
+    }
+
+
+@disp.command("cld-sweep")
+@click.argument("pairs-in", type=PairsInParam())
+@click.argument("db", type=TinyDBParam())
+@click.option("--thresh", type=float, multiple=True, required=True)
+@max_columns_option
+def cld_sweep(pairs_in, db, thresh, max_columns):
+    """
+    Like cld, but for many thresholds at once. Letters are built up
+    incrementally by inserting the pairs which become significant as the
+    threshold rises. One cld-label doc with a "thresh" key is written per
+    threshold. Once --max-columns is exceeded, this and all higher
+    thresholds use the greedy clique cover.
+    """
+    pvalmat, orig_scores, docs = load_pairs_in(pairs_in)
+
+    records = []
+    columns = None
+    fell_back = False
+    all_sig_pairs = []
+    for cur_thresh, sig_pairs in iter_thresh_increments(pvalmat, thresh):
+        logger.info("** thresh: %s **", cur_thresh)
+        sig_pairs = list(sig_pairs)
+        all_sig_pairs.extend(sig_pairs)
+        if not fell_back:
+            try:
+                columns = insert_absorb(
+                    len(pvalmat), sig_pairs, columns, max_columns=max_columns
+                )
+            except TooManyColumns:
+                warn_fallback(max_columns)
+                fell_back = True
+        if fell_back:
+            swept = sweep(clique_cover(len(pvalmat), all_sig_pairs))
+        else:
+            swept = sweep(columns)
+        record = cld_doc(swept, orig_scores, docs)
+        record["thresh"] = cur_thresh
+        records.append(record)
     with transaction(db) as tr:
-        res_len = len(res.keys())
-        letters = [res[idx] for idx in range(res_len)]
-        assert len(letters) == len(docs)
-        tr.insert(
-            {
-                "type": "cld-label",
-                "orig-scores": orig_scores,
-                "docs": docs,
-                "letters": letters,
-            }
-        )
+        for record in records:
+            tr.insert(record)
+
+
+def iter_thresh_increments(pvalmat, threshes):
+    """
+    Yield each threshold in ascending order together with the pairs which
+    became significant since the previous threshold.
+    """
+    _, p_vals = condensed_pairs(pvalmat)
+    idx_a, idx_b = np.triu_indices(len(pvalmat), 1)
+    order = np.argsort(p_vals, kind="stable")
+    sorted_p_vals = p_vals[order]
+    prev = 0
+    for thresh in sorted(threshes):
+        upto = np.searchsorted(sorted_p_vals, thresh, side="right")
+        new = np.sort(order[prev:upto])
+        yield thresh, zip(idx_a[new].tolist(), idx_b[new].tolist())
+        prev = upto
 
 
 @disp.command("nsd-from-best")
-@click.argument("pairs-in", type=TinyDBParam())
+@click.argument("pairs-in", type=PairsInParam())
 @click.argument("db", type=TinyDBParam())
 @click.option("--thresh", type=float, default=0.05)
 @click.option("--delta", type=float, default=0.01)
@@ -159,6 +527,11 @@ def nsd_from_best(pairs_in, db, thresh, delta, exclude_best):
     graph = mk_nsd_graph(pvalmat, thresh)
     for idx, (score, doc) in enumerate(zip(orig_scores, docs)):
         logger.info("%s %s %s", idx, doc, score)
+    with transaction(db) as tr:
+        tr.insert(highlight_doc(graph, orig_scores, docs, delta, exclude_best))
+
+
+def highlight_doc(graph, orig_scores, docs, delta, exclude_best):
     max_score = max(orig_scores)
     if exclude_best:
         max_score = max((score for score in orig_scores if score < max_score))
@@ -166,51 +539,109 @@ def nsd_from_best(pairs_in, db, thresh, delta, exclude_best):
         idx for idx, score in enumerate(orig_scores) if score + delta > max_score
     ]
     logger.info("max_scores: %s", max_scores)
-    nsd_from_max = set(max_scores) | {
-        other_idx for idx in max_scores for other_idx in graph[idx]
-    }
+    nsd_from_max = set(max_scores) | set(
+        np.flatnonzero(graph[max_scores].any(axis=0)).tolist()
+    )
     logger.info("nsd_from_max: %s", nsd_from_max)
     max_guesses = [docs[idx] for idx in max_scores]
     nsd_from_max_guesses = [docs[idx] for idx in nsd_from_max]
+    return {
+        "type": "highlight-guesses",
+        "guesses": nsd_from_max_guesses,
+        "max": max_guesses,
+    }
+
 
+@disp.command("nsd-from-best-sweep")
+@click.argument("pairs-in", type=PairsInParam())
+@click.argument("db", type=TinyDBParam())
+@click.option("--thresh", type=float, multiple=True, required=True)
+@click.option("--delta", type=float, multiple=True, default=[0.01])
+@click.option("--exclude-best/--include-best")
+def nsd_from_best_sweep(pairs_in, db, thresh, delta, exclude_best):
+    """
+    Like nsd-from-best, but for every combination of many thresholds and
+    deltas at once. The graph is updated incrementally by removing the pairs
+    which become significant as the threshold rises. One highlight-guesses
+    doc with "thresh" and "delta" keys is written per combination.
+    """
+    pvalmat, orig_scores, docs = load_pairs_in(pairs_in)
+    num = len(pvalmat)
+    graph = ~np.eye(num, dtype=bool)
+    records = []
+    for cur_thresh, sig_pairs in iter_thresh_increments(pvalmat, thresh):
+        for idx_a, idx_b in sig_pairs:
+            graph[idx_a, idx_b] = False
+            graph[idx_b, idx_a] = False
+        for cur_delta in delta:
+            logger.info("** thresh: %s; delta: %s **", cur_thresh, cur_delta)
+            record = highlight_doc(graph, orig_scores, docs, cur_delta, exclude_best)
+            record["thresh"] = cur_thresh
+            record["delta"] = cur_delta
+            records.append(record)
     with transaction(db) as tr:
-        tr.insert(
-            {
-                "type": "highlight-guesses",
-                "guesses": nsd_from_max_guesses,
-                "max": max_guesses,
-            }
-        )
+        for record in records:
+            tr.insert(record)
 
 
 @disp.command("intersect-nsds")
-@click.argument("dbs", type=TinyDBParam(), nargs=-1)
-def intersect_nsds(dbs):
-    from expcomb.table.utils import key_highlights
-
+@click.argument("db_paths", type=click.Path(exists=True), nargs=-1)
+@click.option("--jobs", "-j", type=int, default=1)
+@click.option("--top", type=int, default=None, help="Only print the K most common.")
+@sweep_options
+def intersect_nsds(db_paths, jobs, top, thresh, delta):
+    """
+    Count how many times each guess is highlighted across many databases or
+    directories of databases.
+    """
+    db_paths = list(iter_db_paths(db_paths))
+    count_db = functools.partial(count_highlights, sweep=sweep_selection(thresh, delta))
     counter = Counter()
-    for db in dbs:
-        db = list(db)
-        assert len(db) == 1
-        highlights = db[0]["guesses"]
-        for highlight in highlights:
-            del highlight["gold"]
-            del highlight["test-corpus"]
-            if "train-corpus" in highlight:
-                del highlight["train-corpus"]
-        keyed_highlights = key_highlights(highlights)
-        for key in keyed_highlights:
-            counter[key] += 1
-    for doc, count in counter.most_common():
+    if jobs > 1:
+        with Pool(jobs) as pool:
+            for db_counter in pool.imap_unordered(count_db, db_paths):
+                counter.update(db_counter)
+    else:
+        for db_path in db_paths:
+            counter.update(count_db(db_path))
+    for doc, count in counter.most_common(top):
         print(f"{count}: {doc}")
 
 
+def count_highlights(db_path, sweep=None):
+    from expcomb.table.utils import key_doc_selectors
+
+    counter = Counter()
+    skipped = 0
+    db = TinyDB(db_path)
+    try:
+        for doc in db.table("results"):
+            if doc.get("type") != "highlight-guesses":
+                continue
+            if not sweep_doc_included(doc, sweep):
+                skipped += 1
+                continue
+            highlights = (
+                {k: v for k, v in highlight.items() if k not in UNKEYED_HIGHLIGHT}
+                for highlight in doc["guesses"]
+            )
+            counter.update(key_doc_selectors(highlights))
+    finally:
+        db.close()
+    warn_skipped_sweep_docs(skipped, sweep)
+    return counter
+
+
 @disp.command("dump")
-@click.argument("pairs-in", type=TinyDBParam())
+@click.argument("pairs-in", type=PairsInParam())
 def dump(pairs_in):
     pvalmat, orig_scores, docs = load_pairs_in(pairs_in)
     logger.info("** pvalmat **")
-    for idx_a, idx_b, b_bigger, p_val in iter_all_pairs_cmp(pvalmat):
+    b_bigger, p_vals = condensed_pairs(pvalmat)
+    idx_a, idx_b = np.triu_indices(len(pvalmat), 1)
+    for idx_a, idx_b, b_bigger, p_val in zip(
+        idx_a.tolist(), idx_b.tolist(), b_bigger.tolist(), p_vals.tolist()
+    ):
         logger.info("%s %s %s: %s", idx_a, idx_b, b_bigger, p_val)
     logger.info("** orig_scores **")
     logger.info("%s", orig_scores)
@@ -0,0 +1,163 @@
+"""
+Byte offset indexes of the lines of possibly very large text files.
+"""
+import os
+import mmap
+import numpy as np
+from expcomb.score_cache import cache_dir, path_entry
+from expcomb.file_utils import atomic_write
+
+INDEX_CACHE_ENV_VAR = "EXPCOMB_LINE_INDEX_CACHE"
+INDEX_SUFFIX = ".lineidx.npz"
+SCAN_CHUNK = 2 ** 24
+# Maximum number of buffers passed to a single os.writev(...) call
+IOV_MAX = 1024
+
+
+def scan_line_offsets(mm, size):
+    """
+    Find the offsets at which each line starts in a memory map followed by
+    the size of the file. A final line without a newline counts as a line,
+    matching readlines().
+    """
+    ends = []
+    for pos in range(0, size, SCAN_CHUNK):
+        chunk = np.frombuffer(mm[pos : pos + SCAN_CHUNK], dtype=np.uint8)
+        newlines = np.flatnonzero(chunk == ord("\n")).astype(np.uint64)
+        ends.append(newlines + (pos + 1))
+    if size and mm[size - 1 : size] != b"\n":
+        ends.append(np.array([size], dtype=np.uint64))
+    return np.concatenate([np.zeros(1, dtype=np.uint64)] + ends)
+
+
+def index_cache_dir():
+    """
+    The directory line indexes are cached in. This is EXPCOMB_LINE_INDEX_CACHE
+    if set, otherwise a subdirectory of EXPCOMB_SCORE_CACHE if that is set,
+    otherwise expcomb/lineidx in the user cache directory.
+    """
+    return cache_dir(INDEX_CACHE_ENV_VAR, "lineidx")
+
+
+def index_path_of(path):
+    return path_entry(index_cache_dir(), path, INDEX_SUFFIX)
+
+
+def load_index(index_path, stat):
+    try:
+        with np.load(index_path) as index:
+            if (
+                int(index["size"]) == stat.st_size
+                and int(index["mtime_ns"]) == stat.st_mtime_ns
+            ):
+                return index["offsets"]
+    except (OSError, KeyError, ValueError):
+        pass
+    return None
+
+
+def save_index(index_path, stat, offsets):
+    try:
+        with atomic_write(index_path, "wb") as index_f:
+            np.savez(
+                index_f,
+                offsets=offsets,
+                size=np.array(stat.st_size),
+                mtime_ns=np.array(stat.st_mtime_ns),
+            )
+    except OSError:
+        pass
+
+
+def line_offsets(path, cache=True):
+    """
+    Get the line offsets of the file at path, using and updating the index
+    cached in index_cache_dir() when cache is true. Indexes are keyed on the
+    absolute path of the file and are only used if its size and modification
+    time match.
+    """
+    stat = os.stat(path)
+    index_path = index_path_of(path)
+    if cache:
+        offsets = load_index(index_path, stat)
+        if offsets is not None:
+            return offsets
+    with LineFile(path, cache=False) as line_file:
+        offsets = line_file.offsets
+    if cache:
+        save_index(index_path, stat, offsets)
+    return offsets
+
+
+def count_lines(path):
+    return len(line_offsets(path)) - 1
+
+
+class LineFile:
+    """
+    A memory mapped file together with the offsets of its lines.
+    """
+
+    def __init__(self, path, cache=True):
+        self.path = path
+        self.f = open(path, "rb")
+        size = os.fstat(self.f.fileno()).st_size
+        if size:
+            self.mm = mmap.mmap(self.f.fileno(), 0, access=mmap.ACCESS_READ)
+            self.view = memoryview(self.mm)
+        else:
+            self.mm = None
+            self.view = memoryview(b"")
+        if cache:
+            self.offsets = line_offsets(path)
+        else:
+            self.offsets = scan_line_offsets(self.mm, size)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def write_sample(self, fd, sample_idxs):
+        """
+        Write the lines with the given indices to the file descriptor fd.
+        """
+        sample_idxs = np.asarray(sample_idxs, dtype=np.int64)
+        starts = self.offsets[sample_idxs].tolist()
+        ends = self.offsets[sample_idxs + 1].tolist()
+        view = self.view
+        for batch_start in range(0, len(starts), IOV_MAX):
+            bufs = [
+                view[start:end]
+                for start, end in zip(
+                    starts[batch_start : batch_start + IOV_MAX],
+                    ends[batch_start : batch_start + IOV_MAX],
+                )
+            ]
+            write_all(fd, bufs)
+
+    def close(self):
+        self.view.release()
+        if self.mm is not None:
+            self.mm.close()
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def write_all(fd, bufs):
+    if hasattr(os, "writev"):
+        written = os.writev(fd, bufs)
+    else:
+        written = 0
+    # Write whatever a short or missing writev left over buffer by buffer
+    for buf in bufs:
+        if written >= len(buf):
+            written -= len(buf)
+            continue
+        remaining = buf[written:]
+        written = 0
+        while len(remaining):
+            remaining = remaining[os.write(fd, remaining) :]
@@ -0,0 +1,191 @@
+import numpy as np
+import click
+from abc import ABC, abstractmethod
+import functools
+from expcomb.utils import TinyDBParam
+from expcomb.doc_utils import pk
+from expcomb.sigtest.store import (
+    ComparedOutParam,
+    dump_item_stats,
+    load_item_stats,
+    write_compared,
+)
+
+# Maximum number of per item or per iteration values held in memory at once
+# by randomise_counts(...)
+RANDOMISE_BLOCK_ELEMS = 2 ** 22
+# Tolerance when checking whether a shuffled difference is at least as big
+# as the original one
+RANDOMISE_EPS = 1e-12
+
+
+@click.group()
+def randomise():
+    pass
+
+
+class Randomiser(ABC):
+    """
+    A paired approximate randomisation test for a metric which can be computed
+    from per item statistics summed over the corpus. For example, the
+    statistics for F1 could be the true positives, false positives and false
+    negatives of each item.
+    """
+
+    @abstractmethod
+    def item_stats(self, gold, guess):
+        """
+        Returns an (items x stats) array of per item statistics.
+        """
+        pass
+
+    @abstractmethod
+    def score_stats(self, summed):
+        """
+        Compute scores from an array of summed statistics. Must work on any
+        array of shape (... x stats) and return an array of shape (...).
+        """
+        pass
+
+
+def mk_randomise(inner):
+
+    @functools.wraps(inner)
+    def wrapper(ctx, *args, **kwargs):
+        randomiser, outf, gold, guess, result, extra_pk = inner(*args, **kwargs)
+        randomise_cmd_inner(randomiser, outf, gold, guess, result, extra_pk)
+
+    return randomise.command("randomise")(click.pass_context(wrapper))
+
+
+def simple_randomise(randomiser, extra_pk=None):
+
+    @mk_randomise
+    @click.argument("outf", type=click.File("wb"))
+    @click.argument("gold", type=click.Path())
+    @click.argument("guess", type=click.Path())
+    @click.argument("result", type=TinyDBParam())
+    def randomise_cmd(outf, gold, guess, result):
+        """
+        Get the per item statistics needed for approximate randomisation.
+        """
+        return randomiser, outf, gold, guess, result, extra_pk
+
+    return randomise_cmd
+
+
+def randomise_cmd_inner(randomiser, outf, gold, guess, result, extra_pk):
+    """
+    Get the per item statistics needed for approximate randomisation.
+    """
+    stats = randomiser.item_stats(gold, guess)
+    docs = list(result)
+    assert len(docs) == 1
+    output = dict(pk(docs[0], extra_pk))
+    output["type"] = "item-stats"
+    dump_item_stats(outf, output, stats)
+
+
+def mk_compare_randomised(inner):
+
+    @functools.wraps(inner)
+    def wrapper(ctx, *args, **kwargs):
+        randomiser, docs, outf, iters, seed = inner(*args, **kwargs)
+        compare_randomised_inner(randomiser, docs, outf, iters, seed)
+
+    return randomise.command("compare-randomised")(click.pass_context(wrapper))
+
+
+def simple_compare_randomised(randomiser):
+
+    @mk_compare_randomised
+    @click.argument("docs", type=click.File("rb"), nargs=-1, required=True)
+    @click.argument("outf", type=ComparedOutParam())
+    @click.option("--iters", type=int, default=10000)
+    @click.option("--seed", type=int, default=None)
+    def res(docs, outf, iters, seed):
+        return randomiser, docs, outf, iters, seed
+
+    return res
+
+
+def compare_randomised_inner(randomiser, docs, outf, iters, seed):
+    """
+    Compare all pairs of item statistics docs and write the result with
+    write_compared(...).
+    """
+    docs = [load_item_stats(doc) for doc in docs]
+    assert len(docs) >= 1
+    stats = np.stack([doc.pop("stats") for doc in docs])
+    orig_scores = randomiser.score_stats(stats.sum(axis=1))
+    progress_ctx = click.progressbar(
+        length=iters, label="Randomising pairs", show_pos=True
+    )
+    with progress_ctx as bar:
+        b_bigger, counts = randomise_counts(
+            randomiser, stats, iters, seed, progress=bar.update
+        )
+    p_vals = (counts + 1) / (iters + 1)
+    write_compared(outf, docs, orig_scores.tolist(), b_bigger, p_vals, iters)
+
+
+def randomise_counts(
+    randomiser,
+    stats,
+    iters,
+    seed=None,
+    block_elems=RANDOMISE_BLOCK_ELEMS,
+    progress=None,
+):
+    """
+    Paired approximate randomisation over all pairs of systems. Takes a
+    (systems x items x stats) array. In each iteration the outputs of every
+    pair of systems are swapped on a random subset of items, which is shared
+    between all pairs. Returns whether b is bigger and the number of
+    iterations where the absolute difference between the shuffled scores was
+    at least the original one as two vectors in IterPairs order.
+    """
+    num_systems, num_items, num_stats = stats.shape
+    totals = stats.sum(axis=1)
+    orig_scores = randomiser.score_stats(totals)
+    num_pairs = num_systems * (num_systems - 1) // 2
+    b_bigger = np.empty(num_pairs, dtype=bool)
+    counts = np.zeros(num_pairs, dtype=np.int64)
+    rng = np.random.RandomState(seed)
+    iter_block = max(1, block_elems // max(num_items, 1))
+    pair_block = max(
+        1, block_elems // (max(iter_block, num_items) * max(num_stats, 1))
+    )
+    done = 0
+    while done < iters:
+        block_iters = min(iter_block, iters - done)
+        swaps = rng.randint(2, size=(block_iters, num_items)).astype(np.float64)
+        pair_idx = 0
+        for idx_a in range(num_systems):
+            for start in range(idx_a + 1, num_systems, pair_block):
+                stop = min(start + pair_block, num_systems)
+                orig_diff = orig_scores[start:stop] - orig_scores[idx_a]
+                item_diff = stats[start:stop] - stats[idx_a]
+                # Statistics moved from b to a with shape (pairs x iters x stats)
+                moved = np.einsum("ti,pis->pts", swaps, item_diff)
+                shuffled_a = totals[idx_a] + moved
+                shuffled_b = totals[start:stop, np.newaxis, :] - moved
+                shuffled_diff = randomiser.score_stats(
+                    shuffled_b
+                ) - randomiser.score_stats(shuffled_a)
+                block_end = pair_idx + stop - start
+                b_bigger[pair_idx:block_end] = orig_diff >= 0
+                counts[pair_idx:block_end] += np.count_nonzero(
+                    np.abs(shuffled_diff)
+                    >= np.abs(orig_diff)[:, np.newaxis] - RANDOMISE_EPS,
+                    axis=1,
+                )
+                pair_idx = block_end
+        done += block_iters
+        if progress is not None:
+            progress(block_iters)
+    return b_bigger, counts
+
+
+if __name__ == "__main__":
+    randomise()
@@ -0,0 +1,212 @@
+"""
+Compact .npz storage for resampled scores and all pairs comparisons.
+"""
+import json
+import pickle
+import click
+import numpy as np
+from tinydb import TinyDB
+from tinyrecord import transaction
+
+NPZ_MAGIC = b"PK\x03\x04"
+
+
+def is_npz_file(f):
+    """
+    Check whether a seekable binary file object contains an .npz file without
+    moving its position.
+    """
+    pos = f.tell()
+    magic = f.read(len(NPZ_MAGIC))
+    f.seek(pos)
+    return magic == NPZ_MAGIC
+
+
+def is_npz_path(path):
+    with open(path, "rb") as f:
+        return is_npz_file(f)
+
+
+def dump_npz(outf, manifest, **arrays):
+    np.savez(outf, manifest=np.array(json.dumps(manifest)), **arrays)
+
+
+def load_manifest(npz):
+    return json.loads(str(npz["manifest"]))
+
+
+def dump_resampled(outf, doc, resampled):
+    orig_score, dist = resampled
+    dump_npz(
+        outf,
+        doc,
+        orig=np.array(orig_score, dtype=np.float64),
+        resampled=np.asarray(dist, dtype=np.float64),
+    )
+
+
+def load_resampled(inf):
+    """
+    Load a resampled doc as written by dump_resampled(...) or a pickled doc
+    from older versions of the resample command.
+    """
+    if not is_npz_file(inf):
+        return pickle.load(inf)
+    with np.load(inf) as npz:
+        doc = load_manifest(npz)
+        doc["resampled"] = (float(npz["orig"]), npz["resampled"])
+    return doc
+
+
+def dump_compared(path, docs, orig_scores, b_bigger, p_vals, **extra):
+    manifest = {"type": "compared", "docs": docs}
+    manifest.update(extra)
+    with open(path, "wb") as outf:
+        dump_npz(
+            outf,
+            manifest,
+            orig_scores=np.asarray(orig_scores, dtype=np.float64),
+            b_bigger=np.asarray(b_bigger, dtype=bool),
+            p_vals=np.asarray(p_vals, dtype=np.float64),
+        )
+
+
+def dump_item_stats(outf, doc, stats):
+    dump_npz(outf, doc, stats=np.asarray(stats, dtype=np.float64))
+
+
+def load_item_stats(inf):
+    with np.load(inf) as npz:
+        doc = load_manifest(npz)
+        doc["stats"] = npz["stats"]
+    return doc
+
+
+def unflatten_pairs(b_bigger, p_vals):
+    """
+    Turn vectors in IterPairs order into the triangular list-of-lists
+    structure of (b_bigger, p_val) pairs.
+    """
+    result = []
+    num_pairs = len(p_vals)
+    start = 0
+    row_len = int((1 + (1 + 8 * num_pairs) ** 0.5) / 2) - 1
+    while row_len >= 0:
+        stop = start + row_len
+        result.append(
+            list(zip(b_bigger[start:stop].tolist(), p_vals[start:stop].tolist()))
+        )
+        start = stop
+        row_len -= 1
+    return result
+
+
+def write_compared(outf, docs, orig_scores, b_bigger, p_vals, iters):
+    """
+    Write an all pairs comparison. When outf is a path, the result is written
+    in the compact binary format, otherwise it is inserted into outf as a
+    TinyDB table.
+    """
+    if isinstance(outf, str):
+        dump_compared(outf, docs, orig_scores, b_bigger, p_vals, iters=iters)
+        return
+    with transaction(outf) as tr:
+        tr.insert(
+            {
+                "type": "compared",
+                "docs": docs,
+                "compared": unflatten_pairs(b_bigger, p_vals),
+                "orig-scores": orig_scores,
+                "iters": iters,
+            }
+        )
+
+
+class CondensedPairs:
+    """
+    Drop-in replacement for the triangular list-of-lists "compared" structure
+    backed by the condensed vectors of an .npz file. Row idx_a contains
+    (b_bigger, p_val) for every idx_b > idx_a.
+    """
+
+    def __init__(self, b_bigger, p_vals, num_systems):
+        self.b_bigger = b_bigger
+        self.p_vals = p_vals
+        self.num_systems = num_systems
+
+    def row_start(self, idx_a):
+        return idx_a * self.num_systems - idx_a * (idx_a + 1) // 2
+
+    def __len__(self):
+        return self.num_systems
+
+    def __getitem__(self, idx_a):
+        if idx_a < 0:
+            idx_a += self.num_systems
+        if not 0 <= idx_a < self.num_systems:
+            raise IndexError(idx_a)
+        start = self.row_start(idx_a)
+        stop = start + self.num_systems - idx_a - 1
+        return list(
+            zip(self.b_bigger[start:stop].tolist(), self.p_vals[start:stop].tolist())
+        )
+
+    def __iter__(self):
+        b_bigger = self.b_bigger.tolist()
+        p_vals = self.p_vals.tolist()
+        for idx_a in range(self.num_systems):
+            start = self.row_start(idx_a)
+            stop = start + self.num_systems - idx_a - 1
+            yield list(zip(b_bigger[start:stop], p_vals[start:stop]))
+
+
+class CompactCompared:
+    """
+    An all pairs comparison as written by dump_compared(...).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with np.load(path) as npz:
+            self.manifest = load_manifest(npz)
+            self.orig_scores = npz["orig_scores"].tolist()
+            self.pvalmat = CondensedPairs(
+                npz["b_bigger"], npz["p_vals"], len(self.manifest["docs"])
+            )
+
+    @property
+    def docs(self):
+        return self.manifest["docs"]
+
+
+def open_pairs_in(path):
+    """
+    Open either a TinyDB containing a "compared" doc or a compact .npz
+    comparison.
+    """
+    if is_npz_path(path):
+        return CompactCompared(path)
+    return TinyDB(path).table("results")
+
+
+class PairsInParam(click.Path):
+
+    def convert(self, value, param, ctx):
+        if not isinstance(value, str):
+            return value
+        return open_pairs_in(super().convert(value, param, ctx))
+
+
+class ComparedOutParam(click.Path):
+    """
+    Where to write an all pairs comparison. Paths ending in .npz are written
+    in the compact binary format, anything else is opened as a TinyDB.
+    """
+
+    def convert(self, value, param, ctx):
+        if not isinstance(value, str):
+            return value
+        path = super().convert(value, param, ctx)
+        if path.endswith(".npz"):
+            return path
+        return TinyDB(path).table("results")
@@ -5,7 +5,13 @@ from pylatex import Document, NoEscape, Package
 
 from expcomb.doc_utils import pk
 from expcomb.filter import empty_filter
-from .utils import clds_from_dbs, docs_from_dbs, highlights_from_dbs, key_doc_selectors
+from expcomb.utils import sweep_options, sweep_selection
+from .utils import (
+    clds_from_dbs,
+    docs_from_dbs,
+    highlights_from_dbs,
+    key_doc_selectors,
+)
 
 
 def indicate_highlights(docs, highlights, pk_extra, key):
@@ -22,13 +28,18 @@ def add_clds(docs, clds, pk_extra):
 
 
 def add_tables(group, tables_tpls, pk_extra):
+    group.add_command(mk_tables_cmd(tables_tpls, pk_extra), "tables")
 
-    @group.command("tables")
+
+def mk_tables_cmd(tables_tpls, pk_extra):
+
+    @click.command("tables")
     @click.pass_context
     @click.argument("db_paths", type=click.Path(), nargs=-1)
     @click.option("--preview/--no-preview")
     @click.option("--table", "-t", multiple=True)
-    def tables_cmd(ctx, db_paths, preview, table):
+    @sweep_options
+    def tables_cmd(ctx, db_paths, preview, table, thresh, delta):
         if preview:
             latex_doc = Document(
                 geometry_options={"paperwidth": "100cm", "paperheight": "100cm"}
@@ -47,10 +58,11 @@ def add_tables(group, tables_tpls, pk_extra):
                 filter = table_tpl[2]
             else:
                 filter = empty_filter
+            sweep = sweep_selection(thresh, delta)
             docs = docs_from_dbs(db_paths, filter, pk_extra)
-            highlights = highlights_from_dbs(db_paths, filter, "guesses")
-            maxs = highlights_from_dbs(db_paths, filter, "max")
-            clds = clds_from_dbs(db_paths, filter)
+            highlights = highlights_from_dbs(db_paths, filter, "guesses", sweep)
+            maxs = highlights_from_dbs(db_paths, filter, "max", sweep)
+            clds = clds_from_dbs(db_paths, filter, sweep)
             add_clds(docs, clds, pk_extra)
             indicate_highlights(docs, highlights, pk_extra, "highlight")
             indicate_highlights(docs, maxs, pk_extra, "max")
@@ -66,3 +78,5 @@ def add_tables(group, tables_tpls, pk_extra):
         if preview:
             latex_doc.generate_pdf()
             call(["evince", "default_filepath.pdf"])
+
+    return tables_cmd
@@ -86,6 +86,9 @@ class Measure(ABC):
     def num_measures(self):
         return 1
 
+    def pick(self, doc, selector, permissive=False):
+        return pick_str(doc["measures"], selector, permissive=permissive)
+
 
 class MeasuresSplit(Measure):
 
@@ -135,6 +138,23 @@ class SelectingMeasure(Measure):
         assert measure
         return measure.get_measures(doc)
 
+    def pick(self, doc, selector, permissive=False):
+        return self.dispatch_measure(doc).pick(doc, selector, permissive=permissive)
+
+
+class PerfMeasure(MeasuresSplit):
+    """
+    Measures taken from the "perf" key of result docs rather than
+    "measures", e.g. "run,wall" or "train,max_rss". Docs without
+    measurements are shown as missing.
+    """
+
+    def pick(self, doc, selector, permissive=False):
+        try:
+            return pick_str(doc.get("perf", {}), selector)
+        except (KeyError, IndexError):
+            return None
+
 
 class InvalidSpecException(Exception):
     pass
@@ -310,19 +330,13 @@ class BoundSqTableSpec:
                 opts = AndFilter(x_filter, y_filter)
                 picked_doc = filter_docs(self.docs, opts)
                 if len(picked_doc) == 1:
+                    measure = self.spec.measure.pick(
+                        picked_doc[0], self.spec.measure.get_measures(picked_doc[0])[0]
+                    )
                     with doc_highlights(picked_doc[0], outf):
-                        outf.write(
-                            escape_latex(
-                                str(
-                                    pick_str(
-                                        picked_doc[0]["measures"],
-                                        self.spec.measure.get_measures(picked_doc[0])[
-                                            0
-                                        ],
-                                    )
-                                )
-                            )
-                        )
+                        # e.g. a PerfMeasure of a doc without measurements
+                        if measure is not None:
+                            outf.write(escape_latex(str(measure)))
                 else:
                     outf.write("---")
                 if col_num < self.y_groups.num_combs() - 1:
@@ -524,7 +538,7 @@ class BoundSumTableSpec:
         if doc:
 
             def get_measure(m):
-                measure = pick_str(doc["measures"], m, permissive=True)
+                measure = self.spec.measure.pick(doc, m, permissive=True)
                 if measure is None:
                     return NoEscape("---")
                 else:
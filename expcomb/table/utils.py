@@ -1,5 +1,9 @@
 from typing import Tuple, List, TYPE_CHECKING
-from expcomb.utils import doc_exp_included
+from expcomb.utils import (
+    doc_exp_included,
+    sweep_doc_included,
+    warn_skipped_sweep_docs,
+)
 from itertools import groupby
 from pylatex.utils import escape_latex
 from expcomb.doc_utils import all_docs_from_dbs, all_docs, expand_db_paths
@@ -77,28 +81,37 @@ def filter_docs(docs, filter):
     ]
 
 
-def highlights_from_dbs(db_paths, filter, key):
+def highlights_from_dbs(db_paths, filter, key, sweep=None):
     docs = all_docs(expand_db_paths(db_paths))
     guesses = []
+    skipped = 0
     for doc in docs:
         if not doc.get("type") == "highlight-guesses":
             continue
+        if not sweep_doc_included(doc, sweep):
+            skipped += 1
+            continue
         for guess in doc[key]:
             if not doc_exp_included(filter, guess["path"], guess):
                 continue
             guesses.append(guess)
-
+    warn_skipped_sweep_docs(skipped, sweep)
     return guesses
 
 
-def clds_from_dbs(db_paths, filter):
+def clds_from_dbs(db_paths, filter, sweep=None):
     docs = all_docs(expand_db_paths(db_paths))
     clds = {}
+    skipped = 0
     for doc in docs:
         if not doc.get("type") == "cld-label":
             continue
+        if not sweep_doc_included(doc, sweep):
+            skipped += 1
+            continue
         for key, cld in zip(key_doc_selectors(doc["docs"]), doc["letters"]):
             clds[key] = cld
+    warn_skipped_sweep_docs(skipped, sweep)
     return clds
 
 
@@ -1,8 +1,12 @@
 import click
 from tinydb import TinyDB
 from os.path import join as pjoin, basename
+from . import logger
 from .filter import SimpleFilter
 
+# Keys added to the docs written by cld-sweep and nsd-from-best-sweep
+SWEEP_KEYS = ("thresh", "delta")
+
 
 def mk_nick(*inbits):
     outbits = []
@@ -56,3 +60,50 @@ class TinyDBParam(click.Path):
             return value
         path = super().convert(value, param, ctx)
         return TinyDB(path).table("results")
+
+
+def sweep_doc_included(doc, sweep=None):
+    """
+    Whether a highlight-guesses or cld-label doc is included given sweep, a
+    dict such as {"thresh": 0.05, "delta": 0.01}. Docs written by the sweep
+    commands are only included when all of their SWEEP_KEYS match, while
+    other docs are always included.
+    """
+    sweep = sweep or {}
+    return all(key not in doc or sweep.get(key) == doc[key] for key in SWEEP_KEYS)
+
+
+def warn_skipped_sweep_docs(skipped, sweep):
+    if skipped:
+        logger.warning(
+            "Skipped %s docs from threshold sweeps not matching %s. "
+            "Select one with --thresh/--delta.",
+            skipped,
+            sweep or {},
+        )
+
+
+def sweep_options(func):
+    """
+    Add options selecting the threshold (and delta) of the docs to read from
+    databases written by cld-sweep or nsd-from-best-sweep.
+    """
+    func = click.option(
+        "--delta",
+        type=float,
+        help="Use highlights from threshold sweeps with this delta.",
+    )(func)
+    func = click.option(
+        "--thresh",
+        type=float,
+        help="Use CLDs and highlights from threshold sweeps at this threshold.",
+    )(func)
+    return func
+
+
+def sweep_selection(thresh, delta):
+    return {
+        key: value
+        for key, value in zip(SWEEP_KEYS, (thresh, delta))
+        if value is not None
+    }
@@ -0,0 +1,182 @@
+"""
+A work queue coordinated through a directory shared between hosts.
+"""
+import os
+import json
+import time
+import socket
+import threading
+from contextlib import contextmanager
+from os.path import join as pjoin
+from expcomb import logger
+from .file_utils import atomic_write
+from .execute import execute_serial, finish, log_summary
+
+
+class WorkQueue:
+    """
+    For each nick the directory can contain <nick>.claim, created with
+    O_EXCL and touched every heartbeat seconds by the worker running it, and
+    <nick>.done or <nick>.failed once it has finished. Claims untouched for
+    stale_after seconds are taken to belong to dead workers. A failed nick is
+    retried until it has failed max_attempts times. Markers written before
+    since are ignored.
+    """
+
+    def __init__(
+        self, path, heartbeat=30.0, stale_after=300.0, max_attempts=2, since=None
+    ):
+        self.path = path
+        self.heartbeat = heartbeat
+        self.stale_after = stale_after
+        self.max_attempts = max_attempts
+        self.since = since
+        self.owner = "{}.{}".format(socket.gethostname(), os.getpid())
+        os.makedirs(path, exist_ok=True)
+
+    def marker_path(self, nick, kind):
+        return pjoin(self.path, "{}.{}".format(nick, kind))
+
+    def marker(self, nick, kind):
+        try:
+            with open(self.marker_path(nick, kind)) as f:
+                marker = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if self.since is not None and marker.get("time", 0) < self.since:
+            return None
+        return marker
+
+    def attempts(self, nick):
+        failed = self.marker(nick, "failed")
+        if failed is None:
+            return 0
+        return failed.get("attempts", 1)
+
+    def is_finished(self, nick):
+        return (
+            self.marker(nick, "done") is not None
+            or self.attempts(nick) >= self.max_attempts
+        )
+
+    def claim(self, nick):
+        """
+        Try to claim nick, taking over its claim if it is stale. Returns
+        whether it was claimed.
+        """
+        claim_path = self.marker_path(nick, "claim")
+        for _ in range(2):
+            try:
+                fd = os.open(claim_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                if not self.break_stale(claim_path):
+                    return False
+                continue
+            with os.fdopen(fd, "w") as f:
+                json.dump({"owner": self.owner, "time": time.time()}, f)
+            # It may have finished between checking and claiming it
+            if self.is_finished(nick):
+                os.unlink(claim_path)
+                return False
+            return True
+        return False
+
+    def break_stale(self, claim_path):
+        """
+        Remove the claim at claim_path if it is stale. Returns whether it was
+        removed.
+        """
+        try:
+            if time.time() - os.stat(claim_path).st_mtime < self.stale_after:
+                return False
+        except FileNotFoundError:
+            return True
+        # Only one worker can move the claim aside
+        moved_path = "{}.{}.stale".format(claim_path, self.owner)
+        try:
+            os.rename(claim_path, moved_path)
+        except FileNotFoundError:
+            return True
+        if time.time() - os.stat(moved_path).st_mtime < self.stale_after:
+            # Another worker retook the claim after we checked it, so put it
+            # back
+            try:
+                os.link(moved_path, claim_path)
+            except FileExistsError:
+                pass
+            os.unlink(moved_path)
+            return False
+        logger.warning("Reclaiming stale claim %s", claim_path)
+        os.unlink(moved_path)
+        return True
+
+    @contextmanager
+    def heartbeating(self, nick):
+        """
+        Touch the claim of nick every heartbeat seconds while in the block.
+        """
+        claim_path = self.marker_path(nick, "claim")
+        stop = threading.Event()
+
+        def beat():
+            while not stop.wait(self.heartbeat):
+                try:
+                    os.utime(claim_path)
+                except OSError:
+                    logger.warning("Lost claim %s", claim_path)
+
+        thread = threading.Thread(target=beat, daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            thread.join()
+
+    def finish(self, outcome):
+        marker = {
+            "owner": self.owner,
+            "time": time.time(),
+            "elapsed": outcome.elapsed,
+            "error": outcome.error,
+        }
+        if outcome.ok:
+            kind = "done"
+        else:
+            kind = "failed"
+            marker["attempts"] = self.attempts(outcome.nick) + 1
+        with atomic_write(self.marker_path(outcome.nick, kind)) as f:
+            json.dump(marker, f)
+        try:
+            os.unlink(self.marker_path(outcome.nick, "claim"))
+        except FileNotFoundError:
+            pass
+
+    def work(self, tasks, poll=10.0):
+        """
+        Run tasks which are not finished and which no live worker has claimed
+        until all of them are finished. Returns the last Outcome of each task
+        run by this worker.
+        """
+        outcomes = {}
+        pending = list(tasks)
+        while True:
+            pending = [task for task in pending if not self.is_finished(task.nick)]
+            if not pending:
+                break
+            ran = False
+            for task in pending:
+                if not self.claim(task.nick):
+                    continue
+                with self.heartbeating(task.nick):
+                    outcome = execute_serial(task, True)
+                finish(task, outcome, None)
+                self.finish(outcome)
+                outcomes[outcome.nick] = outcome
+                ran = True
+            if not ran:
+                # Wait for the other workers in case one of them dies
+                time.sleep(poll)
+        outcomes = list(outcomes.values())
+        log_summary(outcomes)
+        return outcomes
@@ -0,0 +1,81 @@
+from itertools import combinations
+import numpy as np
+import pytest
+from expcomb.sigtest.disp import (
+    TooManyColumns,
+    cld_columns,
+    clique_cover,
+    insert_absorb,
+    iter_bits,
+    sweep,
+    transitive_reduction,
+)
+
+
+def random_sig_pairs(rng, num, density):
+    return [pair for pair in combinations(range(num), 2) if rng.rand() < density]
+
+
+def assert_valid_cld(num, sig_pairs, columns):
+    letters = [set() for _ in range(num)]
+    for col_idx, column in enumerate(columns):
+        for elem in iter_bits(column):
+            letters[elem].add(col_idx)
+    assert all(letters)
+    sig_pairs = set(sig_pairs)
+    for pair in combinations(range(num), 2):
+        idx_a, idx_b = pair
+        assert bool(letters[idx_a] & letters[idx_b]) != (pair in sig_pairs), pair
+
+
+@pytest.mark.parametrize(
+    "mk_columns",
+    [
+        lambda num, sig_pairs: sweep(insert_absorb(num, sig_pairs)),
+        lambda num, sig_pairs: sweep(clique_cover(num, sig_pairs)),
+        lambda num, sig_pairs: cld_columns(num, sig_pairs, max_columns=4),
+    ],
+    ids=["insert_absorb", "clique_cover", "fallback"],
+)
+@pytest.mark.parametrize("seed", range(50))
+def test_cld_valid(mk_columns, seed):
+    rng = np.random.RandomState(seed)
+    num = rng.randint(1, 14)
+    sig_pairs = random_sig_pairs(rng, num, rng.uniform(0, 1))
+    assert_valid_cld(num, sig_pairs, mk_columns(num, sig_pairs))
+
+
+def test_cld_falls_back_on_disjoint_pairs():
+    # 2^k maximal groups for k disjoint significant pairs
+    num = 24
+    sig_pairs = [(idx, idx + 1) for idx in range(0, num, 2)]
+    with pytest.raises(TooManyColumns):
+        insert_absorb(num, sig_pairs, max_columns=256)
+    assert_valid_cld(num, sig_pairs, cld_columns(num, sig_pairs, max_columns=256))
+
+
+def naive_transitive_reduction(adj):
+    reach = adj.copy()
+    for mid in range(len(adj)):
+        reach |= np.outer(reach[:, mid], reach[mid])
+    reduced = adj.copy()
+    for src, dst in zip(*np.nonzero(adj)):
+        if np.any(adj[src] & reach[:, dst]):
+            reduced[src, dst] = False
+    return reduced
+
+
+@pytest.mark.parametrize("seed", range(50))
+def test_transitive_reduction_matches_naive(seed):
+    rng = np.random.RandomState(seed)
+    num = rng.randint(1, 20)
+    adj = np.triu(rng.rand(num, num) < rng.uniform(0, 1), 1)
+    perm = rng.permutation(num)
+    adj = adj[perm][:, perm]
+    assert np.array_equal(transitive_reduction(adj), naive_transitive_reduction(adj))
+
+
+def test_transitive_reduction_rejects_cycles():
+    adj = np.array([[False, True], [True, False]])
+    with pytest.raises(ValueError):
+        transitive_reduction(adj)